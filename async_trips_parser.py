@@ -0,0 +1,153 @@
+"""
+An asynchronous interface for TRIPS Web API.
+Requests share a pool of keep-alive connections, the number of requests in flight is capped, and every request has a
+timeout and is retried with exponential backoff.
+
+:author: Sergey Goldobin
+:date: 07/28/2020
+"""
+
+import asyncio
+import argparse
+from typing import *
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the asynchronous client.
+    aiohttp = None
+
+from logical_form import LogicalForm
+from trips_parser import TripsAPI
+
+
+class TripsAPIError(Exception):
+    """
+    A simple wrapper for failures to obtain a parse from the TRIPS API.
+    """
+    pass
+
+
+class AsyncTripsAPI:
+    """
+    An asyncio wrapper interface to communicate with the web TRIPS API.
+    Use as an async context manager, or call close() when done.
+    """
+
+    def __init__(self, url: str = TripsAPI._URL, max_in_flight: int = 8, timeout: float = 30.0, retries: int = 3,
+                 backoff: float = 0.5):
+        """
+        Configure the client. No connections are opened until the first request.
+        :param url: The parser endpoint.
+        :param max_in_flight: The maximum number of concurrent requests, which is also the connection pool size.
+        :param timeout: Seconds allowed for each attempt, including connecting and reading the reply.
+        :param retries: How many times a failed attempt is retried.
+        :param backoff: Delay before the first retry in seconds. Doubles with every further retry.
+        """
+        if aiohttp is None:
+            raise ImportError('The asynchronous TRIPS client requires aiohttp.')
+        if max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be positive, got {max_in_flight}')
+
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+        self._limit = None  # type: Optional[asyncio.Semaphore]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self) -> NoReturn:
+        """
+        Close all pooled connections.
+        :return:
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """
+        Lazily create the session, so that it binds to the event loop that is actually running.
+        :return:
+        """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._limit = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    async def fetch(self, sentence: str) -> str:
+        """
+        Obtain the raw XML parse of a sentence.
+        :param sentence: A recognized sentence string.
+        :return: The parser's reply.
+        :raises TripsAPIError: If every attempt failed.
+        """
+        session = self._get_session()
+        post_data = {"input": sentence}
+        delay = self.backoff
+        error = None
+
+        async with self._limit:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                try:
+                    async with session.post(self.url, data=post_data) as reply:
+                        # Server errors are worth retrying. Client errors will not go away by themselves.
+                        if reply.status >= 500:
+                            error = f'HTTP {reply.status}'
+                            continue
+                        reply.raise_for_status()
+                        return await reply.text()
+                except aiohttp.ClientResponseError as e:
+                    raise TripsAPIError(f'TRIPS rejected "{sentence}": HTTP {e.status}') from e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = f'{type(e).__name__}: {e}'
+
+        raise TripsAPIError(f'Failed to parse "{sentence}" after {self.retries + 1} attempts. Last error: {error}')
+
+    async def parse(self, sentence: str) -> LogicalForm:
+        """
+        Convert a sentence to Logical Form.
+        :param sentence: A recognized sentence string.
+        :return: A LogicalForm instance.
+        """
+        return LogicalForm(await self.fetch(sentence))
+
+    async def parse_many(self, sentences: Iterable[str],
+                         return_exceptions: bool = False) -> List[Union[LogicalForm, Exception]]:
+        """
+        Convert many sentences to Logical Form concurrently, at most max_in_flight at a time.
+        :param sentences: Recognized sentence strings.
+        :param return_exceptions: If True, a failed sentence yields its exception in place of a LogicalForm.
+            Otherwise, the first failure is raised.
+        :return: LogicalForms in input order.
+        """
+        return await asyncio.gather(*(self.parse(s) for s in sentences), return_exceptions=return_exceptions)
+
+
+async def _main(sentences: List[str], url: str, max_in_flight: int):
+    async with AsyncTripsAPI(url, max_in_flight) as api:
+        for sentence, lf in zip(sentences, await api.parse_many(sentences, return_exceptions=True)):
+            print(f'Parsing into AMR:\t{sentence}')
+            print(lf if isinstance(lf, Exception) else lf.pretty_format())
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("text", nargs='+', help="Sentences to be semantically parsed.")
+    arg_parser.add_argument("-u", "--url", default=TripsAPI._URL, help="TRIPS parser endpoint.")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=8, help="Maximum concurrent requests.")
+    args = arg_parser.parse_args()
+
+    asyncio.run(_main(args.text, args.url, args.jobs))
@@ -0,0 +1,231 @@
+"""
+A stage-by-stage benchmark of the resolution pipeline over a corpus of recorded TRIPS replies.
+
+Every stage is timed on its own, so a change in one of them is not hidden by the others:
+    process_xml     LogicalForm._process_xml
+    relations       Resolver._get_relations_and_senses
+    get_senses      OntologyAdapter.get_senses, once per word
+    satisfy         Resolver._satisfy_constraints
+    match_template  LogicalForm.match_template, against every template given
+    match_library   TemplateLibrary.match, over the same templates
+
+Results are written as JSON and can be compared against a stored baseline.
+
+:author: Sergey Goldobin
+:date: 08/07/2020
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+from typing import *
+
+from logical_form import LogicalForm, XmlBackend
+from resolver import Resolver, ResolveType, MatchEngine, ResolutionContext
+from template_library import TemplateLibrary
+from trips_fixtures import FixtureStore
+
+STAGES = ['process_xml', 'relations', 'get_senses', 'satisfy', 'match_template', 'match_library']
+
+# Statistics compared against a baseline.
+_COMPARED = ['p50', 'p95', 'p99']
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile.
+    :param ordered: Samples in ascending order.
+    :param q: The percentile, 0 to 100.
+    :return:
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Reduce latency samples to a distribution summary. All times are in milliseconds.
+    :param samples: Latencies in seconds.
+    :return:
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'mean': 1000 * total / len(ordered) if ordered else 0.0,
+        'p50': 1000 * percentile(ordered, 50),
+        'p95': 1000 * percentile(ordered, 95),
+        'p99': 1000 * percentile(ordered, 99),
+        'max': 1000 * ordered[-1] if ordered else 0.0,
+        'throughput': len(ordered) / total if total else 0.0  # Operations per second
+    }
+
+
+def _words(lf: LogicalForm) -> List[str]:
+    """
+    Collect the words of every component in a LogicalForm, as the resolver looks them up.
+    :param lf:
+    :return:
+    """
+    words = []
+    seen = set()
+    stack = [lf.get_tree()]
+    while stack:
+        comp = stack.pop()
+        if comp is None or isinstance(comp, str) or comp in seen:
+            continue
+        seen.add(comp)
+        if comp.word:
+            words.append(comp.word[0])
+        for rg in comp.roles:
+            for cs in rg.values():
+                stack.extend(cs)
+    return words
+
+
+def run(corpus: List[str], resolver: Resolver, templates: TemplateLibrary, mode: ResolveType, repeat: int,
+        cold_senses: bool, backend: XmlBackend = XmlBackend.BS4) -> Dict[str, List[float]]:
+    """
+    Time every stage over the corpus.
+    :param corpus: Recorded TRIPS replies.
+    :param resolver: The resolver under test. Its parser is never called.
+    :param templates: Command templates for the matching stages. The stages are skipped if there are none.
+    :param mode: Resolution mode for the satisfy stage.
+    :param repeat: How many passes to make over the corpus.
+    :param cold_senses: Clear the sense cache before every get_senses call, to measure snapshot decoding.
+    :param backend: The XML parser for the process_xml stage.
+    :return: Latency samples in seconds, per stage.
+    """
+    samples = {stage: [] for stage in STAGES}
+    clock = time.perf_counter
+    adapter = resolver._adapter
+
+    for _ in range(repeat):
+        for xml_str in corpus:
+            start = clock()
+            LogicalForm._process_xml(xml_str, backend)
+            samples['process_xml'].append(clock() - start)
+
+            lf = LogicalForm(xml_str, backend=backend)
+
+            for word in _words(lf):
+                if cold_senses:
+                    adapter._cache.clear()
+                start = clock()
+                adapter.get_senses(word)
+                samples['get_senses'].append(clock() - start)
+
+            ctx = ResolutionContext()
+            start = clock()
+            resolver._get_relations_and_senses(ctx, lf)
+            samples['relations'].append(clock() - start)
+
+            start = clock()
+            resolver._satisfy_constraints(ctx, mode)
+            samples['satisfy'].append(clock() - start)
+
+            if templates:
+                start = clock()
+                for t in templates:
+                    lf.match_template(t)
+                samples['match_template'].append(clock() - start)
+
+                start = clock()
+                templates.match(lf)
+                samples['match_library'].append(clock() - start)
+
+    return samples
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Find stages that got slower than a baseline.
+    :param results: Output of this benchmark.
+    :param baseline: A previous output of this benchmark.
+    :param tolerance: Allowed relative slowdown, i.e. 0.1 for 10%.
+    :return: A description of every regression.
+    """
+    regressions = []
+    for stage, stats in results['stages'].items():
+        base = baseline.get('stages', {}).get(stage)
+        if not base or not stats['count'] or not base['count']:
+            continue
+        for stat in _COMPARED:
+            if base[stat] > 0 and stats[stat] > base[stat] * (1 + tolerance):
+                regressions.append(f'{stage} {stat}: {base[stat]:.3f}ms -> {stats[stat]:.3f}ms '
+                                   f'(+{100 * (stats[stat] / base[stat] - 1):.1f}%)')
+    return regressions
+
+
+def main():
+    """
+    Benchmark every stage over a fixture directory, print a table, and optionally save or compare the results.
+    :return:
+    """
+    argp = argparse.ArgumentParser(description='Benchmark the resolution pipeline stage by stage.')
+    argp.add_argument("fixtures", help="Fixture directory of recorded TRIPS replies.")
+    argp.add_argument("-t", "--templates", metavar="DIR", default=None,
+                      help="Directory of command templates for the matching stages.")
+    argp.add_argument("-m", "--mode", choices=[t.value for t in ResolveType], default=ResolveType.STRICT.value)
+    argp.add_argument("-e", "--engine", choices=[e.value for e in MatchEngine], default=MatchEngine.SCALAR.value)
+    argp.add_argument("-x", "--xml-backend", choices=[b.value for b in XmlBackend], default=XmlBackend.BS4.value)
+    argp.add_argument("-n", "--repeat", type=int, default=5, help="Passes over the corpus.")
+    argp.add_argument("--warmup", type=int, default=1, help="Untimed passes before measuring.")
+    argp.add_argument("--cold-senses", action='store_true', help="Measure get_senses with an empty sense cache.")
+    argp.add_argument("-o", "--output", metavar="FILE", default=None, help="Write the results as JSON.")
+    argp.add_argument("-b", "--baseline", metavar="FILE", default=None, help="Compare against a previous output.")
+    argp.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown against the baseline.")
+    args = argp.parse_args()
+
+    corpus = [xml_str for _, xml_str in FixtureStore(args.fixtures)]
+    if not corpus:
+        print(f'No recorded replies in {args.fixtures}')
+        sys.exit(2)
+
+    templates = TemplateLibrary.load(args.templates) if args.templates else TemplateLibrary()
+    mode = ResolveType.parse(args.mode)
+    backend = XmlBackend.parse(args.xml_backend)
+    resolver = Resolver(MatchEngine.parse(args.engine))
+
+    if args.warmup:
+        run(corpus, resolver, templates, mode, args.warmup, args.cold_senses, backend)
+    samples = run(corpus, resolver, templates, mode, args.repeat, args.cold_senses, backend)
+
+    results = {
+        'corpus': {'fixtures': os.path.abspath(args.fixtures), 'size': len(corpus), 'templates': len(templates)},
+        'config': {'mode': args.mode, 'engine': args.engine, 'xml_backend': args.xml_backend, 'repeat': args.repeat,
+                   'cold_senses': args.cold_senses},
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': {stage: summarize(s) for stage, s in samples.items()}
+    }
+
+    print(f'{"stage":<16}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"ops/s":>12}')
+    for stage, stats in results['stages'].items():
+        print(f'{stage:<16}{stats["count"]:>8}{stats["p50"]:>10.3f}{stats["p95"]:>10.3f}{stats["p99"]:>10.3f}'
+              f'{stats["throughput"]:>12.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\nRegressions beyond {100 * args.tolerance:.0f}% of {args.baseline}:')
+            for r in regressions:
+                print(f'\t{r}')
+            sys.exit(1)
+        print(f'\nNo regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+A vectorized alternative to Resolver.matches_predicate.
+
+Every candidate sense is encoded as a row of packed 64-bit words holding its OntologyIndex ancestor closure, plus
+integer columns for its feature values. Every role's Predicate is encoded as one mask row per TYPE/TYPEQ restriction
+and a list of required feature codes. A single NumPy expression then checks all candidate senses against a role at
+once.
+
+:author: Sergey Goldobin
+:date: 07/24/2020
+"""
+
+import threading
+from typing import *
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed when this engine is selected.
+    np = None
+
+from ontology_adapter import Sense, Role
+
+_MISSING = -1  # Feature code for senses that lack a feature entirely
+
+
+class SenseBatch:
+    """
+    A set of candidate senses encoded for vectorized matching.
+    """
+
+    def __init__(self, engine, labels: List[Any], senses: List[Sense]):
+        """
+        Encode a batch of senses. Use BitsetEngine.encode() rather than calling this directly.
+        :param engine: The owning BitsetEngine.
+        :param labels: An arbitrary label for each sense, returned by BitsetEngine.match().
+        :param senses: The senses to encode.
+        """
+        self._engine = engine
+        self.labels = labels
+        self.senses = senses
+        rows = b''.join(engine._row(s) for s in senses)
+        self.ancestors = np.frombuffer(rows, dtype='<u8').reshape(len(senses), engine.words)
+        self._features = {}  # type: Dict[str, np.ndarray]
+
+    def __len__(self):
+        return len(self.senses)
+
+    def feature_column(self, name: str) -> 'np.ndarray':
+        """
+        Get the integer-coded values of one feature across the batch, encoding it on first use.
+        :param name: Feature name.
+        :return: An int32 array with one code per sense, _MISSING where the sense lacks a string value for it.
+        """
+        if name not in self._features:
+            values = [s.features.get(name) for s in self.senses]
+            codes = [self._engine.code(v) if isinstance(v, str) else _MISSING for v in values]
+            self._features[name] = np.array(codes, dtype=np.int32)
+        return self._features[name]
+
+
+class BitsetEngine:
+    """
+    Encodes senses and roles into bit vectors and matches them in bulk. Safe to share between threads.
+    """
+
+    def __init__(self, n_types: int):
+        """
+        Create an engine for an ontology of the given size.
+        :param n_types: The number of types in the OntologyIndex.
+        """
+        if np is None:
+            raise ImportError('The bitset matching engine requires NumPy.')
+
+        self.words = max(1, (n_types + 63) // 64)  # 64-bit words per ancestry row
+        self._rows = {}  # type: Dict[int, bytes]  # Encoded ancestry per type id
+        self._codes = {}  # type: Dict[str, int]  # Feature value interning table
+        self._predicates = {}  # type: Dict[int, Tuple[List[np.ndarray], List[Tuple[str, int]]]]
+        self._lock = threading.Lock()
+
+    def _row(self, s: Sense) -> bytes:
+        """
+        Get the packed ancestry row of a sense.
+        :param s:
+        :return: Little-endian bytes, self.words * 8 long.
+        """
+        row = self._rows.get(s.type_id)
+        if row is None:
+            # Threads encoding the same type at once build equal rows; keep whichever came first.
+            row = self._rows.setdefault(s.type_id, s.ancestors.to_bytes(self.words * 8, 'little'))
+        return row
+
+    def code(self, value: str) -> int:
+        """
+        Get the integer code of a feature value. Values are compared case-insensitively.
+        :param value:
+        :return:
+        """
+        value = value.lower()
+        code = self._codes.get(value)
+        if code is None:
+            # Codes are assigned by table size, so two threads must not add values at once.
+            with self._lock:
+                code = self._codes.setdefault(value, len(self._codes))
+        return code
+
+    def encode(self, labels: List[Any], senses: List[Sense]) -> SenseBatch:
+        """
+        Encode a batch of candidate senses.
+        :param labels: An arbitrary label for each sense.
+        :param senses: The senses to encode.
+        :return:
+        """
+        return SenseBatch(self, labels, senses)
+
+    def _compile_role(self, role: Role) -> Tuple[List['np.ndarray'], List[Tuple[str, int]]]:
+        """
+        Encode a role's compiled Predicate as mask rows and required feature codes.
+        :param role:
+        :return: A tuple of (type masks, (feature name, value code) pairs)
+        """
+        p = role.predicate
+        compiled = self._predicates.get(p.pid)
+        if compiled is not None:
+            return compiled
+
+        masks = [np.frombuffer(m.to_bytes(self.words * 8, 'little'), dtype='<u8') for m in p.type_masks]
+        features = [(f_name, self.code(f_val)) for f_name, f_val in p.features]
+
+        return self._predicates.setdefault(p.pid, (masks, features))
+
+    def match(self, role: Role, batch: SenseBatch) -> 'np.ndarray':
+        """
+        Check every sense in a batch against the restrictions of a role.
+        :param role: The role whose restrictions must be satisfied.
+        :param batch: Candidate senses.
+        :return: A boolean array, True where the sense satisfies every restriction.
+        """
+        masks, features = self._compile_role(role)
+        result = np.ones(len(batch), dtype=bool)
+
+        for mask in masks:
+            result &= np.bitwise_and(batch.ancestors, mask).any(axis=1)
+        for f_name, f_code in features:
+            result &= batch.feature_column(f_name) == f_code
+
+        return result
+
+    def matching_labels(self, role: Role, batch: SenseBatch) -> List[Any]:
+        """
+        Get the labels of all senses in a batch that satisfy a role, in batch order.
+        :param role:
+        :param batch:
+        :return:
+        """
+        return [batch.labels[i] for i in np.flatnonzero(self.match(role, batch))]
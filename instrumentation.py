@@ -0,0 +1,294 @@
+"""
+Timing and counter instrumentation for the resolution pipeline.
+
+The pipeline reports to the process-wide INSTRUMENTS object:
+    Timers      parse           TripsAPI.parse, including the web request
+                process_xml     LogicalForm._process_xml
+                get_senses      OntologyAdapter.get_senses
+                satisfy         Resolver._satisfy_constraints
+    Counters    sense_lookups       words looked up in the ontology
+                restriction_checks  child senses tested or scored against a role's restrictions, in either mode
+                candidates          senses found for the type variables of a sentence
+                bindings            child senses found to fit a parent's role
+
+Nothing is recorded until a sink is added, and until then every hook costs a single attribute check. Sinks receive
+every observation: HistogramSink aggregates them in memory, and PrometheusFileSink also writes them out in the
+Prometheus text format, e.g. for the node exporter's textfile collector.
+Observations are per process; resolve_many workers record into their own copies.
+
+:author: Sergey Goldobin
+:date: 08/12/2020
+"""
+
+import abc
+import bisect
+import functools
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import *
+
+# Histogram bucket upper bounds, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+_clock = time.perf_counter
+
+
+class Sink(abc.ABC):
+    """
+    A destination for observations. Sinks must be safe to call from several threads.
+    """
+
+    @abc.abstractmethod
+    def timing(self, name: str, seconds: float) -> NoReturn:
+        """
+        Record how long one call of a timed stage took.
+        :param name: The stage.
+        :param seconds:
+        :return:
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count(self, name: str, n: int) -> NoReturn:
+        """
+        Add to a counter.
+        :param name: The counter.
+        :param n: The amount to add.
+        :return:
+        """
+        raise NotImplementedError
+
+    def flush(self) -> NoReturn:
+        """
+        Write out anything buffered. Does nothing by default.
+        :return:
+        """
+        pass
+
+
+@dataclass(frozen=True)
+class TimerStats:
+    """
+    A point-in-time view of one timer's histogram.
+    """
+    count: int
+    total: float  # Seconds
+    buckets: Tuple[float, ...]  # Upper bounds, in seconds
+    counts: Tuple[int, ...]  # Observations per bucket, not cumulative. The last one is above every bound.
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+        :param q: The quantile, 0 to 1.
+        :return: Seconds. Infinity if it falls above every bound.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class HistogramSink(Sink):
+    """
+    Aggregates timings into fixed-bucket histograms and counters in memory.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Create an empty sink.
+        :param buckets: Ascending histogram bucket upper bounds, in seconds.
+        """
+        if list(buckets) != sorted(buckets):
+            raise ValueError(f'Bucket bounds must be ascending, got {buckets}')
+
+        self.buckets = tuple(buckets)
+        self._timers = {}  # type: Dict[str, List]  # name -> [bucket counts, count, total]
+        self._counters = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def timing(self, name: str, seconds: float) -> NoReturn:
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            timer[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            timer[1] += 1
+            timer[2] += seconds
+
+    def count(self, name: str, n: int) -> NoReturn:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def timers(self) -> Dict[str, TimerStats]:
+        """
+        Get the histograms of every timer observed so far.
+        :return:
+        """
+        with self._lock:
+            return {name: TimerStats(count, total, self.buckets, tuple(counts))
+                    for name, (counts, count, total) in sorted(self._timers.items())}
+
+    def counters(self) -> Dict[str, int]:
+        """
+        Get the value of every counter observed so far.
+        :return:
+        """
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+
+class PrometheusFileSink(HistogramSink):
+    """
+    A HistogramSink that writes its totals to a file in the Prometheus text exposition format.
+    Timers become histograms named <prefix>_<name>_seconds, and counters become <prefix>_<name>_total.
+    """
+
+    def __init__(self, path: str, prefix: str = 'resolver', interval: Optional[float] = None,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Create a sink. Nothing is written until the first flush.
+        :param path: The file to write. It is replaced atomically, so a scraper never reads half of it.
+        :param prefix: Prepended to every metric name.
+        :param interval: If set, also flush whenever this many seconds have passed since the last write.
+        :param buckets: Ascending histogram bucket upper bounds, in seconds.
+        """
+        super().__init__(buckets)
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self._written = _clock()
+
+    def timing(self, name: str, seconds: float) -> NoReturn:
+        super().timing(name, seconds)
+        self._maybe_flush()
+
+    def count(self, name: str, n: int) -> NoReturn:
+        super().count(name, n)
+        self._maybe_flush()
+
+    def _maybe_flush(self) -> NoReturn:
+        if self.interval is not None and _clock() - self._written >= self.interval:
+            self.flush()
+
+    def format(self) -> str:
+        """
+        Render the current totals in the Prometheus text format.
+        :return:
+        """
+        lines = []
+        for name, stats in self.timers().items():
+            metric = f'{self.prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, n in zip(stats.buckets, stats.counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {stats.count}')
+            lines.append(f'{metric}_sum {stats.total!r}')
+            lines.append(f'{metric}_count {stats.count}')
+        for name, value in self.counters().items():
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return ''.join(line + '\n' for line in lines)
+
+    def flush(self) -> NoReturn:
+        self._written = _clock()
+        text = self.format()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class Instrumentation:
+    """
+    Fans observations out to a set of sinks. Disabled, and nearly free, while there are none.
+    """
+
+    def __init__(self):
+        self.enabled = False  # Checked by every hook before doing any work
+        self._sinks = ()  # type: Tuple[Sink, ...]
+        self._lock = threading.Lock()
+
+    @property
+    def sinks(self) -> Tuple[Sink, ...]:
+        return self._sinks
+
+    def add_sink(self, sink: Sink) -> Sink:
+        """
+        Start sending observations to a sink.
+        :param sink:
+        :return: The sink.
+        """
+        with self._lock:
+            self._sinks = self._sinks + (sink,)
+            self.enabled = True
+        return sink
+
+    def remove_sink(self, sink: Sink) -> NoReturn:
+        """
+        Stop sending observations to a sink. It is not flushed.
+        :param sink:
+        :return:
+        """
+        with self._lock:
+            self._sinks = tuple(s for s in self._sinks if s is not sink)
+            self.enabled = bool(self._sinks)
+
+    def timing(self, name: str, seconds: float) -> NoReturn:
+        for sink in self._sinks:
+            sink.timing(name, seconds)
+
+    def count(self, name: str, n: int = 1) -> NoReturn:
+        for sink in self._sinks:
+            sink.count(name, n)
+
+    def flush(self) -> NoReturn:
+        for sink in self._sinks:
+            sink.flush()
+
+    def timed(self, name: str) -> Callable:
+        """
+        Decorate a function to report the duration of every call, including calls that raise.
+        :param name: The timer to report to.
+        :return:
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = _clock()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.timing(name, _clock() - start)
+            return wrapper
+        return decorate
+
+
+# The process-wide instrumentation the pipeline reports to.
+INSTRUMENTS = Instrumentation()
@@ -6,9 +6,27 @@ A class hierarchy for a compact and simplified AMR Logical Form representation.
 
 CS 788.01 MS Capstone Project
 """
+import sys
+import threading
+from enum import Enum
+from io import BytesIO
+from types import MappingProxyType
 from typing import *
 from bs4 import BeautifulSoup, NavigableString, Tag, Comment
 
+from instrumentation import INSTRUMENTS
+
+try:
+    from lxml import etree
+except ImportError:  # lxml is only needed for the streaming XML backend.
+    etree = None
+
+_RDF_NS = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+
+# Shared, read-only stand-ins for components without parameters or roles, so that such components need no storage.
+_NO_PARAMS = MappingProxyType({})
+_NO_ROLES = (MappingProxyType({}),)
+
 
 class CommandTemplateError(Exception):
     """
@@ -17,6 +35,21 @@ class CommandTemplateError(Exception):
     pass
 
 
+class XmlBackend(Enum):
+    """
+    Parsers available for TRIPS parser output.
+    """
+    BS4 = "bs4"  # Build a complete BeautifulSoup DOM, then walk it
+    LXML = "lxml"  # Stream rdf:Description elements with lxml.etree.iterparse
+
+    @staticmethod
+    def parse(string: str):
+        for t in XmlBackend:
+            if t.value == string:
+                return t
+        raise ValueError(f'Invalid XmlBackend {string}')
+
+
 # TODO: Move to utilities?
 def compose(f: Callable, g: Callable) -> Callable:
     """
@@ -37,8 +70,21 @@ class LogicalForm:
     class Component:
         """
         A component of the LF tree structure.
+        Large LF batches and template libraries keep many of these in memory, so they are kept compact: no instance
+        __dict__, interned strings, tuples rather than lists, and shared empty parameter and role storage.
         """
 
+        __slots__ = ('comp_id', 'indicator', 'comp_type', 'word', 'param_mapping', '_resolved', 'roles',
+                     '_cache_epoch', '_resolved_cache', '_params_cache', '_shape_cache')
+
+        # Cached subtree properties are valid only while a node's _cache_epoch equals this counter.
+        # Any change to the shape of a tree bumps it, since subtrees may be shared between trees.
+        _epoch = 0
+
+        # Numbers of the distinct component shapes seen so far.
+        _shapes = {}  # type: Dict[Tuple, int]
+        _shapes_lock = threading.Lock()  # Numbers are assigned by table size, so insertions must not interleave
+
         def __init__(self, comp_id: str, indicator: str = None, comp_type: str = None, word: str = None,
                      resolved: bool = True):
             """
@@ -51,15 +97,126 @@ class LogicalForm:
             """
             # Since Components can be concrete or ambiguous, there must be room to express the ambiguity
             self.comp_id = comp_id  # Must be unique
-            self.indicator = [] if not indicator else [indicator]
-            self.comp_type = [] if not comp_type else [comp_type]
-            self.word = None if not word else [word]
-            self.param_mapping = {}  # Storage for parameters which may be bound by some components.
+            self.indicator = () if not indicator else (sys.intern(indicator),)  # type: Tuple[str, ...]
+            self.comp_type = () if not comp_type else (sys.intern(comp_type),)  # type: Tuple[str, ...]
+            self.word = None if not word else (sys.intern(word),)  # type: Optional[Tuple[str, ...]]
+            # Storage for parameters which may be bound by some components. Replaced by a dict once there are any.
+            self.param_mapping = _NO_PARAMS  # type: Mapping[str, Optional[str]]
             self._resolved = resolved
 
             # Optionally, the component may have a set of roles.
             # SPEECHACTs have a CONTENT role, a PUT has AGENT, AFFECTED, and some more.
-            self.roles = [{}]  # type: List[Dict[str: List[LogicalForm.Component]]]
+            # Role lists are replaced by tuples and empty role storage by _NO_ROLES once the component is built.
+            self.roles = [{}]  # type: Sequence[Dict[str: Sequence[LogicalForm.Component]]]
+
+            # Cached values of the resolved and bound_params properties.
+            self._cache_epoch = -1
+            self._resolved_cache = None  # type: Optional[bool]
+            self._params_cache = None  # type: Optional[FrozenSet[str]]
+            self._shape_cache = None  # type: Optional[int]
+
+        def _seal(self) -> NoReturn:
+            """
+            Finish building the component: freeze role lists into tuples and share storage for empty roles.
+            :return: None
+            """
+            if len(self.roles) == 1 and not self.roles[0]:
+                self.roles = _NO_ROLES
+                return
+
+            for rg in self.roles:
+                for name, comps in rg.items():
+                    rg[name] = tuple(comps)
+
+        def __getstate__(self):
+            # The shared read-only mappings cannot be pickled; they are restored on load.
+            state = {slot: getattr(self, slot) for slot in self.__slots__}
+            state['param_mapping'] = dict(self.param_mapping)
+            state['roles'] = [dict(rg) for rg in self.roles]
+            return state
+
+        def __setstate__(self, state):
+            for slot, value in state.items():
+                setattr(self, slot, value)
+            if not self.param_mapping:
+                self.param_mapping = _NO_PARAMS
+            self._cache_epoch = -1  # Epochs are per process.
+            self._seal()
+
+        @staticmethod
+        def _invalidate() -> NoReturn:
+            """
+            Drop the cached subtree properties of every Component.
+            :return: None
+            """
+            LogicalForm.Component._epoch += 1
+
+        def _check_cache(self) -> NoReturn:
+            """
+            Reset this node's cached values if they are from an older epoch.
+            :return: None
+            """
+            if self._cache_epoch != LogicalForm.Component._epoch:
+                self._cache_epoch = LogicalForm.Component._epoch
+                self._resolved_cache = None
+                self._params_cache = None
+                self._shape_cache = None
+
+        @property
+        def shape(self) -> int:
+            """
+            A number identifying the structure of this component and its subtree. Components that would match exactly
+            the same LFs and bind the same parameters share a number, whatever their IDs.
+            :return:
+            """
+            return self._describe([])[0]
+
+        def _describe(self, path: List['LogicalForm.Component']) -> Tuple[Union[int, Tuple], int]:
+            """
+            Describe the structure of this component's subtree for shape.
+            A component reached again on a cycle is described by how many steps up the path it is, so equal cycles
+            get equal, deterministic descriptions. A subtree referring back above itself is only described within its
+            ancestor's description, and is not numbered or cached.
+            :param path: The components being described, outermost first.
+            :return: The shape number, or the description of a subtree referring back above itself, and the depth of
+                the outermost component on the path it refers back to.
+            """
+            self._check_cache()
+            depth = len(path)
+            if self._shape_cache is not None:
+                return self._shape_cache, depth
+            for i, comp in enumerate(path):
+                if comp is self:
+                    return ('CYCLE', depth - i), i
+
+            path.append(self)
+            reach = depth
+            roles = []
+            for rg in self.roles:
+                group = []
+                for name, comps in rg.items():
+                    described = []
+                    for c in comps:
+                        if isinstance(c, str):
+                            described.append(c)
+                            continue
+                        shape, c_reach = c._describe(path)
+                        reach = min(reach, c_reach)
+                        described.append(shape)
+                    group.append((name, tuple(described)))
+                roles.append(tuple(group))
+            path.pop()
+
+            description = (self.indicator, self.comp_type, self.word, tuple(self.param_mapping.keys()), tuple(roles))
+            if reach < depth:
+                return description, reach
+            shapes = LogicalForm.Component._shapes
+            shape = shapes.get(description)
+            if shape is None:
+                with LogicalForm.Component._shapes_lock:
+                    shape = shapes.setdefault(description, len(shapes))
+            self._shape_cache = shape
+            return self._shape_cache, depth
 
         @property
         def bound_params(self) -> Set[str]:
@@ -67,14 +224,24 @@ class LogicalForm:
             Get the set of all parameters bound by this Component and all its children.
             :return:
             """
-            result = set(self.param_mapping.keys())
+            # Callers get a copy they are free to modify.
+            return set(self._bound_params_cached())
 
-            for rg in self.roles:
-                for rcs in rg.values():
-                    for comp in rcs:
-                        result = result.union(comp.bound_params)
+        def _bound_params_cached(self) -> FrozenSet[str]:
+            """
+            Same as bound_params, without copying the cached set.
+            :return:
+            """
+            self._check_cache()
+            if self._params_cache is None:
+                result = set(self.param_mapping.keys())
+                for rg in self.roles:
+                    for rcs in rg.values():
+                        for comp in rcs:
+                            result.update(comp._bound_params_cached())
+                self._params_cache = frozenset(result)
 
-            return set(result)
+            return self._params_cache
 
         def _move(self, other):
             """
@@ -84,12 +251,14 @@ class LogicalForm:
             """
             other = other._root
             self.comp_id = other.comp_id
-            self.indicator = list(other.indicator)
-            self.comp_type = list(other.comp_type)
-            self.word = None if other.word is None else list(other.word)
+            self.indicator = other.indicator
+            self.comp_type = other.comp_type
+            self.word = other.word
             self.param_mapping = other.param_mapping
             self._resolved = other._resolved
             self.roles = other.roles
+            # This node's cache is stale now. Its ancestors are invalidated once the whole resolve() is done.
+            self._cache_epoch = -1
 
         def __str__(self):
             """
@@ -125,14 +294,17 @@ class LogicalForm:
             A component is considered resolved it itself and all descendants are resolved.
             :return:
             """
-            result = self._resolved
-            for rg in self.roles:
-                for rcomps in rg.values():
-                    for comp in rcomps:
-                        # This being a property propagates changes upwards.
-                        result = result and comp.resolved
+            self._check_cache()
+            if self._resolved_cache is None:
+                result = self._resolved
+                for rg in self.roles:
+                    for rcomps in rg.values():
+                        for comp in rcomps:
+                            # This being a property propagates changes upwards.
+                            result = result and comp.resolved
+                self._resolved_cache = result
 
-            return result
+            return self._resolved_cache
 
         def resolve(self, comps):
             """
@@ -140,6 +312,17 @@ class LogicalForm:
             :param comps:
             :return:
             """
+            self._resolve(comps)
+            # Resolution may have changed any subtree below this one, and subtrees can be shared.
+            LogicalForm.Component._invalidate()
+
+        def _resolve(self, comps):
+            """
+            Recursive part of resolve(). Cached values may go stale during the walk, but only ever by reporting a
+            subtree as unresolved when it no longer is, which costs an extra visit rather than a wrong result.
+            :param comps:
+            :return:
+            """
             # If this components explicitly expects resolution
             if not self._resolved:
                 if self.comp_id not in comps:
@@ -152,20 +335,22 @@ class LogicalForm:
                     for cs in rg.values():
                         for c in cs:
                             if not c.resolved:
-                                c.resolve(comps)  # TODO Double check that this actually updates the references.
+                                c._resolve(comps)  # TODO Double check that this actually updates the references.
 
     __component_id = 0
 
     """
     End of nested class declarations
     """
-    def __init__(self, xml_str: str = None, template: Union[str, Tag] = None, require_id: bool = False):
+    def __init__(self, xml_str: str = None, template: Union[str, Tag] = None, require_id: bool = False,
+                 backend: XmlBackend = XmlBackend.BS4):
         """
         Given an XML TRIPS parser output or a TRIPS template, process it into a convenient object.
         One of the two strings is required, but not both.
         :param xml_str: The TRIPS parser output.
         :param template: The command template string OR a root BS tag.
         :param require_id: If true, a lack of explicit ID on the component will cause an error. Only affects templates.
+        :param backend: The parser used for TRIPS parser output. Both produce identical trees.
         """
         if (xml_str and template) or (not xml_str and not template):
             raise ValueError("Expected either XML string or template, but not both.")
@@ -176,7 +361,7 @@ class LogicalForm:
         self._resolved = False  # Are there any components with a pending from_id?
 
         if xml_str:
-            self._root = LogicalForm._process_xml(xml_str)
+            self._root = LogicalForm._process_xml(xml_str, backend)
             self.from_xml = True
         else:
             self._root = self._process_template(template)
@@ -219,15 +404,91 @@ class LogicalForm:
         if self._root is None and lf._root is None:
             return True, {}
 
-        return LogicalForm._compare_help(self._root, lf._root)
+        return LogicalForm._compare_help(self._root, lf._root, {})
+
+    def match_template_all(self, lf) -> List[Dict[str, str]]:
+        """
+        Like match_template, but find every distinct way the other LogicalForm matches this one.
+        :param lf: Other LogicalForm
+        :return: The parameters bound by each match, starting with the one match_template reports.
+            An empty list if there is no match.
+        """
+        if not isinstance(lf, LogicalForm):
+            raise ValueError(f'Expected {LogicalForm} argument, got {type(lf)}.')
+
+        if bool(self._root) != bool(lf._root):
+            return []
+
+        if self._root is None and lf._root is None:
+            return [{}]
+
+        return LogicalForm._compare_all(self._root, lf._root, {})
+
+    # Memo table placeholder for a comparison that is still in progress.
+    _IN_PROGRESS = object()
 
     @staticmethod
-    def _compare_help(this, other) -> Tuple[bool, Dict[str, str]]:
+    def _memo_key(this, other) -> Tuple[int, int]:
+        """
+        Key a comparison of two components in a memo table.
+        The compared component is keyed by identity: the LF is a graph, and the same component can be reached along
+        several paths. Templates repeat the same structure in different rolegroups as separate components, so the
+        template component is keyed by its shape instead.
+        :param this: Compared instance.
+        :param other: Instance compared to.
+        :return:
+        """
+        return id(this), other.shape
+
+    @staticmethod
+    def _surface_match(this, other) -> bool:
+        """
+        Compare the indicators, types and words of two components. Empty ones are wildcards.
+        :param this: Compared instance.
+        :param other: Instance compared to.
+        :return:
+        """
+        # Lists share a common element if their intersection iss a nonempty set.
+        lst_common = lambda lst_t: bool(set(lst_t[0]).intersection(set(lst_t[1])))
+
+        # Indicators match if any of them are wildcards (empty lists) or if the intersection of sets is nonempty
+        match = not (this.indicator and other.indicator) or lst_common((this.indicator, other.indicator))
+        # Same for types
+        match = match and (not (this.comp_type and other.comp_type) or lst_common((this.comp_type, other.comp_type)))
+        # Same for words
+        match = match and (not (this.word and other.word) or lst_common((this.word, other.word)))
+        return match
+
+    @staticmethod
+    def _matching_rolegroups(this, other) -> List[Tuple[Dict, Dict]]:
+        """
+        Find all the rolegroups that match between this and other.
+        :param this: Compared instance.
+        :param other: Instance compared to.
+        :return: Pairs of (own rolegroup, other rolegroup).
+        """
+        check_q = []
+        for rg in this.roles:
+            for rg_other in other.roles:
+                command_roles = set(rg.keys())
+                template_roles = set(rg_other.keys())
+
+                # The roles of the template must be a subset of the roles of the command.
+                # i.e. If the command has roles A, B, and C, and the template has role B, then the template matches.
+                # However, template with B and D is NOT a match to command A, B, C
+                if all(r in command_roles for r in template_roles):
+                    # The rolegroups match roles
+                    check_q.append((rg, rg_other))
+        return check_q
+
+    @staticmethod
+    def _compare_help(this, other, memo: Dict = None) -> Tuple[bool, Dict[str, str]]:
         """
         Recursive helper function for LF comparison.
         Parameters will be extracted from 'this' using the mappings of 'other'
         :param this: Compared instance.
         :param other: Instance compared to.
+        :param memo: Results of comparisons already made during this match, by _memo_key.
         :return:
         """
         # this and other are expected to be Components at the same level of the tree.
@@ -244,17 +505,32 @@ class LogicalForm:
             match = this in other.word
             return match, {p_name: this for p_name in other.param_mapping.keys()}
 
-        # Lists share a common element if their intersection iss a nonempty set.
-        lst_common = lambda lst_t: bool(set(lst_t[0]).intersection(set(lst_t[1])))
+        if memo is None:
+            memo = {}
+        key = LogicalForm._memo_key(this, other)
+        known = memo.get(key)
+        if known is LogicalForm._IN_PROGRESS:
+            # The pair is being compared further up: the LF or the template has a cycle. A match cannot depend on
+            # itself, so this path fails.
+            return False, {}
+        if known is not None:
+            return known
 
-        # Indicators match if any of them are wildcards (empty lists) or if the intersection of sets is nonempty
-        match = not (this.indicator and other.indicator) or lst_common((this.indicator, other.indicator))
-        # Same for types
-        match = match and (not (this.comp_type and other.comp_type) or lst_common((this.comp_type, other.comp_type)))
-        # Same for words
-        match = match and (not (this.word and other.word) or lst_common((this.word, other.word)))
+        memo[key] = LogicalForm._IN_PROGRESS
+        result = LogicalForm.__compare_uncached(this, other, memo)
+        memo[key] = result
+        return result
 
-        if not match:
+    @staticmethod
+    def __compare_uncached(this, other, memo: Dict) -> Tuple[bool, Dict[str, str]]:
+        """
+        The body of _compare_help, for a pair of components not compared before.
+        :param this: Compared instance.
+        :param other: Instance compared to.
+        :param memo: Shared with _compare_help.
+        :return:
+        """
+        if not LogicalForm._surface_match(this, other):
             # No surface-level match means no need to recurse further.
             # Also no need to return any parameters from this branch.
             return False, {}
@@ -264,25 +540,11 @@ class LogicalForm:
         mapped_val = this.word[0] if this.word else None
         param_map = {k: mapped_val for k in other.param_mapping.keys()}
 
-        # Find all the rolegroups that match between this and other.
-        check_q = []
-        for rg in this.roles:
-            for rg_other in other.roles:
-                command_roles = set(rg.keys())
-                template_roles = set(rg_other.keys())
-
-                # The roles of the template must be a subset of the roles of the command.
-                # i.e. If the command has roles A, B, and C, and the template has role B, then the template matches.
-                # However, template with B and D is NOT a match to command A, B, C
-                if all(r in command_roles for r in template_roles):
-                    # The rolegroups match roles
-                    check_q.append((rg, rg_other))
-
         # For each pair of matching rolegroups, recurse on all corresponding components.
         # At least one rolegroup has to match in order for the whole template to match.
         param_set = {}
         one_rg_match = False
-        for this_rg, other_rg in check_q:
+        for this_rg, other_rg in LogicalForm._matching_rolegroups(this, other):
 
             # Every role must fully match within a rolegroup
             all_match = True
@@ -296,13 +558,13 @@ class LogicalForm:
                 to_match = this_rg[name][0]  # This is the component the template needs to match.
                 candidates = other_rg[name]  # This is the candidate components
 
-                # Recurse on all options from the template. At least one must match.
-                results = map(lambda x: LogicalForm._compare_help(to_match, x), candidates)
-                results = list(filter(lambda x: x[0], results))
-                if not results:
+                # Recurse on the options from the template. At least one must match; the first one that does is used.
+                result = next((r for r in (LogicalForm._compare_help(to_match, x, memo) for x in candidates)
+                               if r[0]), None)
+                if result is None:
                     all_match = False
                     break
-                for k, v in results[0][1].items():
+                for k, v in result[1].items():
                     if k not in rg_set:
                         rg_set[k] = v
 
@@ -325,6 +587,54 @@ class LogicalForm:
 
         return True, param_map
 
+    @staticmethod
+    def _compare_all(this, other, memo: Dict) -> List[Dict[str, str]]:
+        """
+        Recursive helper for match_template_all. Follows _compare_help, but keeps every matching rolegroup and
+        template option instead of stopping at the first.
+        :param this: Compared instance.
+        :param other: Instance compared to.
+        :param memo: Results of comparisons already made during this match, by _memo_key.
+        :return: The distinct parameter sets of all matches, in the order _compare_help would consider them.
+        """
+        if isinstance(this, str):
+            if this not in other.word:
+                return []
+            return [{p_name: this for p_name in other.param_mapping.keys()}]
+
+        key = LogicalForm._memo_key(this, other)
+        known = memo.get(key)
+        if known is LogicalForm._IN_PROGRESS:
+            return []  # A cycle, as in _compare_help.
+        if known is not None:
+            return known
+
+        memo[key] = LogicalForm._IN_PROGRESS
+        results = []
+        if LogicalForm._surface_match(this, other):
+            mapped_val = this.word[0] if this.word else None
+            param_map = {k: mapped_val for k in other.param_mapping.keys()}
+
+            for this_rg, other_rg in LogicalForm._matching_rolegroups(this, other):
+                # Partial parameter sets of this rolegroup, extended one role at a time.
+                rg_sets = [{}]
+                for name in this_rg.keys():
+                    if name not in other_rg:
+                        continue
+                    options = [r for x in other_rg[name] for r in LogicalForm._compare_all(this_rg[name][0], x, memo)]
+                    rg_sets = [{**option, **rg_set} for rg_set in rg_sets for option in options]
+                    if not rg_sets:
+                        break
+
+                results.extend({**rg_set, **param_map} for rg_set in rg_sets)
+
+        # Different paths may bind the same parameters.
+        unique = {}
+        for r in results:
+            unique.setdefault(frozenset(r.items()), r)
+        memo[key] = list(unique.values())
+        return memo[key]
+
     """
     ID resolution
     """
@@ -365,58 +675,63 @@ class LogicalForm:
         Even small trees can get a bit verbose, but this is still a helpful representation.
         :return:
         """
-        return LogicalForm.__format_component(self._root, 0, set())
+        return ''.join(self.format_lines())
 
-    @staticmethod
-    def __format_role(role: Tuple[str, List[Union[Component, str]]], depth: int, seen: Set[Component]) -> str:
-        """
-        A helper function for pretty_format, mutually recursive with __format_component.
-        :param role: The role tuple being formatted.
-        :param depth: Nested depth level.
-        :param seen: Set of seen Components used to break potential infinite loops.
-        :return: String representation of the role.
-        """
-        role_name, role_comps = role
-        result = ('|  ' * depth) + f'<role {role_name}>\n'
-        for c in role_comps:
-            # Display all of the role's components
-            if isinstance(c, str):
-                result += ('|  ' * (depth + 1)) + c + '\n'
-            else:
-                result += LogicalForm.__format_component(c, depth + 1, seen)
+    def write(self, stream: TextIO) -> NoReturn:
+        """
+        Write the pretty_format representation to a text stream line by line, without building it in memory.
+        :param stream: Any object with a write(str) method, i.e. a file or a logging handler's stream.
+        :return: None
+        """
+        for line in self.format_lines():
+            stream.write(line)
 
-        return result
+    def format_lines(self) -> Iterator[str]:
+        """
+        Generate the pretty_format representation one line at a time.
+        The tree is walked with an explicit stack, so the cost per line does not grow with the depth of the tree.
+        :return: A generator of newline-terminated lines.
+        """
+        # The stack holds components still to be formatted as (component, depth),
+        # and lines ready to be emitted as (line, None).
+        stack = [(self._root, 0)]
+        seen = set()  # Seen Components, used to break potential infinite loops.
+        while stack:
+            item, depth = stack.pop()
+            if depth is None:
+                yield item
+                continue
 
-    @staticmethod
-    def __format_component(comp: Component, depth: int, seen: Set[Component]) -> str:
-        """
-        A helper function for pretty_format, mutually recursive with __format_role.
-        :param comp: The component being formatted.
-        :param depth: Nested depth level.
-        :param seen: Set of seen Components used to break potential infinite loops.
-        :return: String representation of the component.
-        """
-        if comp in seen:
-            return ''
-        seen.add(comp)
-
-        # First, get the base of the component.
-        result = ('|  ' * depth) + str(comp) + '\n'
-        # Special case for 'closed' components with no child roles.
-        if len(comp.roles) == 1 and not comp.roles[0]:
-            return result
-
-        for rg in comp.roles:
-            # Mark the beginning of a rolegroup
-            result += ('|  ' * (depth + 1)) + '<rolegroup>\n'
-            # Now show all the roles.
-            for rtup in rg.items():
-                result += LogicalForm.__format_role(rtup, depth + 2, seen)
-
-            # Mark the end of a rolegroup
-            result += ('|  ' * (depth + 1)) + '</rolegroup>\n'
+            comp = item
+            if comp in seen:
+                continue
+            seen.add(comp)
 
-        return result
+            # First, get the base of the component.
+            yield ('|  ' * depth) + str(comp) + '\n'
+            # Special case for 'closed' components with no child roles.
+            if len(comp.roles) == 1 and not comp.roles[0]:
+                continue
+
+            pending = []
+            for rg in comp.roles:
+                # Mark the beginning of a rolegroup
+                pending.append((('|  ' * (depth + 1)) + '<rolegroup>\n', None))
+                # Now show all the roles.
+                for role_name, role_comps in rg.items():
+                    pending.append((('|  ' * (depth + 2)) + f'<role {role_name}>\n', None))
+                    for c in role_comps:
+                        # Display all of the role's components
+                        if isinstance(c, str):
+                            pending.append((('|  ' * (depth + 3)) + c + '\n', None))
+                        else:
+                            pending.append((c, depth + 3))
+
+                # Mark the end of a rolegroup
+                pending.append((('|  ' * (depth + 1)) + '</rolegroup>\n', None))
+
+            # Components are expanded in the order they appear in.
+            stack.extend(reversed(pending))
 
     """
     String Parsing
@@ -480,13 +795,13 @@ class LogicalForm:
             # Role children can be plain strings or nested components.
             if isinstance(child, NavigableString) and child != "\n":
                 # Interpret plain text role values as closed components with words
-                tmp = LogicalForm.Component(LogicalForm._next_id())
-                tmp.word = [child.strip(' \n')]
+                tmp = LogicalForm.Component(LogicalForm._next_id(), word=child.strip(' \n'))
+                tmp._seal()
                 components.append(tmp)
             else:
                 components.append(LogicalForm.__parse_component(child))
 
-        return role_name, components
+        return sys.intern(role_name), tuple(components)
 
     @staticmethod
     def __parse_component(root: Tag) -> Component:
@@ -525,23 +840,25 @@ class LogicalForm:
         # further in the pipeline. Initialize them in storage.
         if 'map_param' in root.attrs:
             params = map(str.strip, root.attrs['map_param'].split(','))
+            cmp.param_mapping = {}
             for p in params:
                 cmp.param_mapping[p] = None  # Values get filled in during template matching.
                 # TODO: Could the dictionary be reduced to a set? Actual mapping happens within LogicalForm
 
         # If any of the following 3 attributes are populated, then those specific values are expected of the template.
         # Otherwise, component lists are left empty to signal a wildcard.
+        normalize = compose(sys.intern, compose(str.upper, str.strip))
         if 'indicator' in root.attrs:
-            cmp.indicator = list(map(compose(str.upper, str.strip), root.attrs['indicator'].split(',')))
+            cmp.indicator = tuple(map(normalize, root.attrs['indicator'].split(',')))
 
         if 'type' in root.attrs:
-            cmp.comp_type = list(map(compose(str.upper, str.strip), root.attrs['type'].split(',')))
+            cmp.comp_type = tuple(map(normalize, root.attrs['type'].split(',')))
 
         if 'word' in root.attrs:
-            cmp.word = list(map(compose(str.upper, str.strip), root.attrs['word'].split(',')))
+            cmp.word = tuple(map(normalize, root.attrs['word'].split(',')))
         else:
             # If the word tag was absent, then it's a wildcard.
-            cmp.word = []
+            cmp.word = ()
 
         # Finally, handle the component's children.
         # The only acceptable children are <role> and <rolegroup> tags.
@@ -552,6 +869,7 @@ class LogicalForm:
         children = list(filter(lambda c: isinstance(c, Tag), root.children))
         # If the component has no children, we are done.
         if not children:
+            cmp._seal()
             return cmp
 
         first_name = children[0].name
@@ -580,15 +898,21 @@ class LogicalForm:
                 raise CommandTemplateError(f'Unexpected tag {root.name} instead of <role> or <rolegroup>')
 
         # Unless there were exceptions, the component is parsed to completion.
+        cmp._seal()
         return cmp
 
     @staticmethod
-    def _process_xml(xml_string) -> Component:
+    @INSTRUMENTS.timed('process_xml')
+    def _process_xml(xml_string, backend: XmlBackend = XmlBackend.BS4) -> Component:
         """
         Convert an XML string to a Logical Form.
         :param xml_string: The LF encoded string.
+        :param backend: The XML parser to use.
         :return: A root component of the hierarchy.
         """
+        if backend is XmlBackend.LXML:
+            return LogicalForm.__process_xml_lxml(xml_string)
+
         bs = BeautifulSoup(xml_string, 'xml')
         components = {}  # type: Dict[str, LogicalForm.Component]
 
@@ -605,29 +929,95 @@ class LogicalForm:
                 # Skip meaningless entries.
                 if isinstance(c, NavigableString):
                     continue
-                if c.name == 'indicator':
-                    component.indicator.append(c.text)
-                elif c.name == 'type':
-                    component.comp_type.append(c.text)
-                elif c.name == 'word':
-                    if component.word is None:
-                        component.word = [c.text]
-                    else:
-                        component.word.append(c.text)
-                elif c.prefix == 'role':
-                    # Initialize the list if necessary
-                    if c.name not in component.roles[0]:
-                        component.roles[0][c.name] = []
-
-                    if 'rdf:resource' in c.attrs:
-                        role_comp_id = c['rdf:resource']  # Skip the 'V' prefix if needed
-                        # Wrap in a list to allow isinstance() differentiation
-                        component.roles[0][c.name].append([role_comp_id])
-                    else:
-                        # Some roles are basic strings and can be resolved on first pass.
-                        component.roles[0][c.name].append(c.text)
+                LogicalForm.__add_xml_field(component, c.name, c.prefix, c.text, c.attrs.get('rdf:resource'))
             components[component.comp_id] = component
 
+        return LogicalForm.__link_components(components, root_id)
+
+    @staticmethod
+    def __process_xml_lxml(xml_string) -> Component:
+        """
+        Convert an XML string to a Logical Form by streaming its rdf:Description elements.
+        Each element is turned into a Component as soon as it has been read, then discarded.
+        :param xml_string: The LF encoded string.
+        :return: A root component of the hierarchy.
+        """
+        if etree is None:
+            raise ImportError('The lxml XML backend requires lxml.')
+
+        if isinstance(xml_string, str):
+            xml_string = xml_string.encode('utf-8')
+
+        components = {}  # type: Dict[str, LogicalForm.Component]
+        root_id = None
+
+        for _, desc in etree.iterparse(BytesIO(xml_string), events=('end',), tag=_RDF_NS + 'Description'):
+            component = LogicalForm.Component(desc.get(_RDF_NS + 'ID'))
+            if root_id is None:
+                root_id = component.comp_id
+
+            for c in desc:
+                # Skip comments and processing instructions.
+                if not isinstance(c.tag, str):
+                    continue
+                text = ''.join(c.itertext())
+                LogicalForm.__add_xml_field(component, etree.QName(c).localname, c.prefix, text,
+                                            c.get(_RDF_NS + 'resource'))
+            components[component.comp_id] = component
+
+            # Free the element and any already processed siblings.
+            desc.clear()
+            while desc.getprevious() is not None:
+                del desc.getparent()[0]
+
+        if root_id is None:
+            raise IndexError('No rdf:Description elements in TRIPS parser output.')
+
+        return LogicalForm.__link_components(components, root_id)
+
+    @staticmethod
+    def __add_xml_field(component: Component, name: str, prefix: Optional[str], text: str,
+                        resource: Optional[str]) -> NoReturn:
+        """
+        Record one child element of an rdf:Description on its Component. Shared by both XML backends.
+        :param component: The Component being built.
+        :param name: Local name of the element.
+        :param prefix: Namespace prefix of the element.
+        :param text: Text content of the element.
+        :param resource: The element's rdf:resource attribute, if any.
+        :return: None
+        """
+        if name == 'indicator':
+            component.indicator += (sys.intern(text),)
+        elif name == 'type':
+            component.comp_type += (sys.intern(text),)
+        elif name == 'word':
+            if component.word is None:
+                component.word = (sys.intern(text),)
+            else:
+                component.word += (sys.intern(text),)
+        elif prefix == 'role':
+            name = sys.intern(name)
+            # Initialize the list if necessary
+            if name not in component.roles[0]:
+                component.roles[0][name] = []
+
+            if resource is not None:
+                role_comp_id = resource  # Skip the 'V' prefix if needed
+                # Wrap in a list to allow isinstance() differentiation
+                component.roles[0][name].append([role_comp_id])
+            else:
+                # Some roles are basic strings and can be resolved on first pass.
+                component.roles[0][name].append(text)
+
+    @staticmethod
+    def __link_components(components: Dict[str, Component], root_id: str) -> Component:
+        """
+        Replace the pending ID references left in role lists with the Components they refer to.
+        :param components: All components of the LF, by ID.
+        :param root_id: ID of the root component.
+        :return: The root component.
+        """
         # All components have been processed. Now, they need to be connected into a tree.
         for comp in components.values():
             for rname, rval in comp.roles[0].items():
@@ -639,6 +1029,7 @@ class LogicalForm:
                     else:
                         resolved_targets.append(r_target)
                 comp.roles[0][rname] = resolved_targets
+            comp._seal()
 
         # All components are now connected into a tree structure in memory.
         # Returning a reference to the root component therefore extracts the whole structure.
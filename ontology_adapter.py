@@ -5,10 +5,15 @@ A wrapper for pyTrips ontology browser.
 :date: 07/07/2020
 """
 
+import threading
 from typing import *
-import pytrips.ontology as trips
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from enum import Enum
+from types import MappingProxyType
+
+from instrumentation import INSTRUMENTS
+from ontology_snapshot import OntologySnapshot, load_snapshot
 
 
 class RestrictionType(Enum):
@@ -31,92 +36,521 @@ class RestrictionType(Enum):
         return self.value
 
 
-@dataclass
+@dataclass(frozen=True)
 class Restriction:
     _ALL_TYPES = 'type'
 
     type: RestrictionType
-    values: List[Union[str, Tuple[str, ...]]]
+    values: Union[str, Tuple[Union[str, Tuple[str, ...]], ...]]
+    type_mask: int = 0  # For TYPE/TYPEQ restrictions, the OntologyIndex bitmask of acceptable types
 
     @property
     def wildcard(self):
         return self.values == Restriction._ALL_TYPES
 
 
-@dataclass
+@dataclass(frozen=True)
+class Predicate:
+    """
+    A role's restriction list compiled into a normalized, hashable test.
+    Identical restriction lists compile to the same Predicate, identified by pid.
+    """
+    type_masks: Tuple[int, ...]  # One OntologyIndex mask per non-wildcard TYPE/TYPEQ restriction
+    features: FrozenSet[Tuple[str, str]]  # Required (feature, lower-cased value) pairs
+    pid: int = field(default=-1, compare=False)
+
+    @property
+    def trivial(self) -> bool:
+        """
+        Does this predicate accept every sense?
+        :return:
+        """
+        return not self.type_masks and not self.features
+
+    def evaluate(self, s: 'Sense') -> bool:
+        """
+        Test a sense against this predicate without consulting any memo table.
+        :param s: The sense to test.
+        :return:
+        """
+        for mask in self.type_masks:
+            if not s.ancestors & mask:
+                return False
+        return self.features <= s.feature_set
+
+    def violations(self, s: 'Sense') -> Tuple[int, int]:
+        """
+        Count the restrictions a sense fails, for scoring near misses.
+        :param s: The sense to test.
+        :return: (violated TYPE/TYPEQ restrictions, missing feature values)
+        """
+        types = sum(1 for mask in self.type_masks if not s.ancestors & mask)
+        return types, len(self.features - s.feature_set)
+
+
+class PredicateTable:
+    """
+    An interning table that compiles restriction lists into shared Predicates.
+    """
+
+    def __init__(self):
+        self._predicates = {}  # type: Dict[Predicate, Predicate]
+        self._lock = threading.Lock()  # Ids are assigned by table size, so insertions must not interleave
+
+    def __len__(self):
+        return len(self._predicates)
+
+    def compile(self, restrictions: Iterable[Restriction]) -> Predicate:
+        """
+        Compile a restriction list, reusing an existing Predicate if an equivalent one was compiled before.
+        :param restrictions: Restrictions with their type masks already filled in.
+        :return:
+        """
+        masks = set()
+        features = set()
+        for r in restrictions:
+            if r.type in [RestrictionType.TYPE, RestrictionType.TYPEQ]:
+                if not r.wildcard:
+                    masks.add(r.type_mask)
+            elif r.type is RestrictionType.FEATURES:
+                for f_name, f_val in r.values:
+                    if isinstance(f_val, str):
+                        features.add((f_name, f_val.lower()))
+
+        key = Predicate(tuple(sorted(masks)), frozenset(features))
+        predicate = self._predicates.get(key)
+        if predicate is None:
+            with self._lock:
+                predicate = self._predicates.get(key)
+                if predicate is None:
+                    predicate = Predicate(key.type_masks, key.features, pid=len(self._predicates))
+                    self._predicates[key] = predicate
+        return predicate
+
+
+class MatchMemo:
+    """
+    A bounded memo table of (sense name, predicate id) -> match result.
+    When full, the oldest entry is evicted. Lookups are lock-free; insertions and evictions are serialized so that
+    threads sharing the table cannot corrupt it. The counters are approximate under concurrent use.
+    """
+
+    def __init__(self, maxsize: int = 1 << 16):
+        """
+        Create an empty memo table.
+        :param maxsize: The maximum number of results to keep.
+        """
+        if maxsize < 1:
+            raise ValueError(f'Memo size must be positive, got {maxsize}')
+
+        self.maxsize = maxsize
+        self._results = {}  # type: Dict[Tuple[str, int], bool]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def matches(self, s: 'Sense', p: Predicate) -> bool:
+        """
+        Test a sense against a predicate, consulting the memo table first.
+        :param s: The sense to test.
+        :param p: A Predicate produced by a PredicateTable.
+        :return:
+        """
+        key = (s.name, p.pid)
+        result = self._results.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = p.evaluate(s)
+        with self._lock:
+            if key not in self._results and len(self._results) >= self.maxsize:
+                del self._results[next(iter(self._results))]
+                self.evictions += 1
+            self._results[key] = result
+        return result
+
+    def clear(self) -> NoReturn:
+        """
+        Drop all results and reset the counters.
+        :return:
+        """
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> 'CacheStats':
+        """
+        Get a snapshot of the memo counters.
+        :return:
+        """
+        return CacheStats(self.hits, self.misses, self.evictions, len(self._results), self.maxsize)
+
+
+# Restriction lists and their match results are shared by every adapter in the process.
+PREDICATES = PredicateTable()
+MATCH_MEMO = MatchMemo()
+
+
+@dataclass(frozen=True)
 class Role:
     """
     A role has a name and a set of restrictions, as well as an optionality
     """
     role: str
     optional: bool
-    restrictions: List[Restriction]
+    restrictions: Tuple[Restriction, ...]
+    predicate: Predicate = None  # The restrictions compiled by PREDICATES
 
     def is_specific(self):
         return not any(r.wildcard for r in self.restrictions)
 
 
-@dataclass
+@dataclass(frozen=True)
 class Sense:
     """
-    A word sense is a name combined with a collection of roles and restrictions
+    A word sense is a name combined with a collection of roles and restrictions.
+    Senses are shared between all callers of OntologyAdapter.get_senses, so they are immutable. They are also
+    hashable, keyed by the ontology type they describe.
     """
     name: str
-    roles: Dict[str, Role]  # A mapping of semantic role slot names to corresponding information
-    features: Dict[str, str]  # A map of features of this sense
-    ancestry: List[str]  # An ascending ontological hierarchy
+    roles: Mapping[str, Role]  # A mapping of semantic role slot names to corresponding information
+    features: Mapping[str, str]  # A map of features of this sense
+    ancestry: Tuple[str, ...]  # An ascending ontological hierarchy
+    type_id: int = -1  # The id of this sense's type in the OntologyIndex
+    ancestors: int = 0  # OntologyIndex bitmask of this type and all of its ancestors
+    feature_set: FrozenSet[Tuple[str, str]] = frozenset()  # (feature, lower-cased value) pairs for matching
 
     def __repr__(self):
         return f'Sense(name="{self.name}")'
 
+    def __hash__(self):
+        # The mappings are read-only views and cannot be hashed; equal senses always describe the same type.
+        return hash((self.name, self.type_id))
 
-class OntologyAdapter:
 
-    _ROOT = 'ont::root'
+@dataclass(frozen=True)
+class CacheStats:
+    """
+    A point-in-time view of SenseCache or MatchMemo counters.
+    """
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: Optional[int]
 
-    def __init__(self):
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SenseCache:
+    """
+    A memo table of word -> Senses with least-recently-used eviction. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 1024):
+        """
+        Create an empty cache.
+        :param maxsize: The maximum number of words to keep. None means unbounded, 0 disables caching.
+        """
+        if maxsize is not None and maxsize < 0:
+            raise ValueError(f'Cache size must be non-negative, got {maxsize}')
+
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # type: OrderedDict[str, Tuple[Sense, ...]]
+        self._lock = threading.Lock()  # Every lookup reorders the entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, word: str) -> Optional[Tuple[Sense, ...]]:
+        """
+        Look up the senses of a word, marking it as recently used.
+        :param word: A normalized word.
+        :return: The cached senses, or None on a miss.
+        """
+        with self._lock:
+            senses = self._entries.get(word)
+            if senses is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(word)
+            return senses
+
+    def put(self, word: str, senses: Tuple[Sense, ...]) -> NoReturn:
+        """
+        Store the senses of a word, evicting the least recently used entry if the cache is full.
+        :param word: A normalized word.
+        :param senses: The word's senses.
+        :return:
+        """
+        if self.maxsize == 0:
+            return
+
+        with self._lock:
+            self._entries[word] = senses
+            self._entries.move_to_end(word)
+            if self.maxsize is not None and len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> NoReturn:
+        """
+        Drop all entries and reset the counters.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Get a snapshot of the cache counters.
+        :return:
+        """
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._entries), self.maxsize)
+
+
+class OntologyIndex:
+    """
+    A one-time index over every type in the ontology snapshot.
+    Each type is identified by its snapshot id, and its ancestor closure (the type itself and everything above it) is
+    precomputed as a bitmask with one bit per type id. Checking whether a type descends from any of a set of types is
+    then a single bitwise AND.
+    """
+
+    def __init__(self, ont: OntologySnapshot):
+        """
+        Build the index.
+        :param ont: The snapshot to index.
+        """
+        self._ids = {}  # type: Dict[str, int]
+        self._closure = []  # type: List[int]
+        self._ancestry = []  # type: List[Tuple[str, ...]]
+
+        # Snapshot ids are ordered top-down, so a parent's closure is always ready before its children need it.
+        for t in range(len(ont)):
+            name = OntologyIndex.normalize(ont.name(t))
+            self._ids[name] = t
+
+            parent = ont.parent(t)
+            if parent < 0:
+                self._closure.append(1 << t)
+                self._ancestry.append(())
+            else:
+                self._closure.append((1 << t) | self._closure[parent])
+                self._ancestry.append((OntologyIndex.normalize(ont.name(parent)),) + self._ancestry[parent])
+
+    def __len__(self):
+        return len(self._closure)
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        """
+        Bring a type name to the form used in role restrictions: no 'ont::' prefix, '-obj' rather than '-object'.
+        :param name:
+        :return:
+        """
+        return name.split('ont::')[-1].lower().replace('-object', '-obj')
+
+    def type_id(self, name: str) -> Optional[int]:
+        """
+        Get the id of a type by name.
+        :param name: A type name in any of its spellings.
+        :return: The id, or None if the type is not in the ontology.
+        """
+        return self._ids.get(OntologyIndex.normalize(name))
+
+    def closure(self, type_id: int) -> int:
+        """
+        Get the bitmask of a type and all of its ancestors.
+        :param type_id:
+        :return:
+        """
+        return self._closure[type_id]
+
+    def ancestry(self, type_id: int) -> Tuple[str, ...]:
+        """
+        Get the normalized names of all ancestors of a type in ascending order, excluding the type itself.
+        :param type_id:
+        :return:
+        """
+        return self._ancestry[type_id]
+
+    def mask(self, names: Union[str, Iterable[str]]) -> int:
+        """
+        Get the bitmask of a collection of types. Names not in the ontology are ignored.
+        :param names: A type name or a collection of them, as found in raw restrictions.
+        :return:
+        """
+        if isinstance(names, str):
+            names = (names,)
+
+        result = 0
+        for n in names:
+            t = self.type_id(n) if isinstance(n, str) else None
+            if t is not None:
+                result |= 1 << t
+        return result
+
+    def descends_from(self, type_id: int, mask: int) -> bool:
+        """
+        Test whether a type is, or descends from, any of the types in a mask.
+        :param type_id:
+        :param mask: A bitmask produced by mask()
+        :return:
+        """
+        return bool(self._closure[type_id] & mask)
+
+
+class OntologyAdapter:
+
+    def __init__(self, snapshot_path: str = None, cache_size: Optional[int] = 1024):
         """
         Initialize the adapter.
+        :param snapshot_path: Location of the compiled ontology snapshot. It is built on first use if necessary.
+        :param cache_size: How many words to keep memoized senses for. None is unbounded, 0 disables the cache.
         """
-        self._ont = trips.load()
+        self._ont = load_snapshot(snapshot_path)  # type: OntologySnapshot
+        self._cache = SenseCache(cache_size)
+        self.index = OntologyIndex(self._ont)
 
-    def get_senses(self, word: str) -> List[Sense]:
+    def __reduce__(self):
+        # Sent to another process as its snapshot path; the receiver maps the same file with an empty cache.
+        return OntologyAdapter, (self._ont.path, self._cache.maxsize)
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        return self._cache.stats()
+
+    @INSTRUMENTS.timed('get_senses')
+    def get_senses(self, word: str) -> Tuple[Sense, ...]:
         """
         Given a word, fetch a collection of its Senses
         :param word: The word to look up in the ontology.
-        :return: A list of the word's Senses
+        :return: A tuple of the word's Senses. The Senses are shared and must not be modified.
+        """
+        key = OntologySnapshot.normalize_word(word)
+        senses = self._cache.get(key)
+        if senses is None:
+            senses = self._build_senses(key)
+            self._cache.put(key, senses)
+
+        return senses
+
+    def _build_senses(self, word: str) -> Tuple[Sense, ...]:
+        """
+        Decode the Senses of a word from the ontology snapshot.
+        :param word: A normalized word.
+        :return:
         """
-        ont_types = self._ont.get_word(word)
-        senses = []
+        return tuple(_decode_sense(self._ont, self.index, t) for t in self._ont.types_for(word))
 
-        for t in ont_types:
-            name = str(t)
-            roles = {}
+    def freeze(self) -> 'OntologyView':
+        """
+        Decode the whole ontology into a read-only view.
+        :return:
+        """
+        return OntologyView(self._ont, self.index)
 
-            # Capture information about roles
-            for r in t.arguments:
-                role = r.role
-                optional = r.optionality != 'REQUIRED'
 
-                restrictions = []
-                for raw in r.getRawRestrictions():
-                    rest = Restriction(type=RestrictionType.from_string(raw[0]), values=raw[1])
-                    restrictions.append(rest)
+class OntologyView:
+    """
+    A read-only view of the whole ontology, decoded up front.
+    Every type's Sense is built once and shared by all words that denote it, and nothing is cached or counted on
+    lookup. The view never changes after construction, so any number of threads can look up senses in one without
+    locks. Matching those senses still goes through the process-wide MATCH_MEMO, which briefly takes a lock to store
+    each result it has not seen before.
+    Building it takes about a second; use OntologyAdapter where only a few words are ever looked up.
+    """
 
-                roles[role] = Role(role, optional, restrictions)
+    __slots__ = ('index', 'path', '_words')
 
-            # Copy the features over
-            features = {k: v for k, v in t.sem.features.items()}
+    def __init__(self, ont: OntologySnapshot, index: OntologyIndex = None):
+        """
+        Decode every type and word of a snapshot.
+        :param ont: The snapshot to decode. It is not used after construction.
+        :param index: An index of the snapshot, if one was already built.
+        """
+        self.index = index or OntologyIndex(ont)  # type: OntologyIndex
+        self.path = ont.path  # The snapshot it was decoded from
+        senses = [_decode_sense(ont, self.index, t) for t in range(len(ont))]
+        words = {word: tuple(senses[t] for t in ont.types_for(word)) for word in ont.words()}
+        self._words = MappingProxyType(words)  # type: Mapping[str, Tuple[Sense, ...]]
 
-            # Compute complete ancestry
-            ancestry = []
-            cursor = t
-            while cursor.parent != OntologyAdapter._ROOT:
-                ancestry.append(cursor.parent.name.replace('-object', '-obj'))
-                cursor = cursor.parent
+    def __len__(self):
+        return len(self._words)
 
-            sense = Sense(name, roles, features, ancestry)
-            senses.append(sense)
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._words)
 
-        return senses
+    def __reduce__(self):
+        # Sent to another process as its snapshot path, and decoded again there.
+        return _load_view, (self.path,)
+
+    @INSTRUMENTS.timed('get_senses')
+    def get_senses(self, word: str) -> Tuple[Sense, ...]:
+        """
+        Given a word, fetch a collection of its Senses
+        :param word: The word to look up in the ontology.
+        :return: A tuple of the word's Senses, empty for unknown words.
+        """
+        return self._words.get(OntologySnapshot.normalize_word(word), ())
+
+
+def _load_view(path: str) -> OntologyView:
+    """
+    Decode a view of a snapshot file, e.g. one received from another process.
+    :param path:
+    :return:
+    """
+    return OntologyView(load_snapshot(path))
+
+
+def _decode_sense(ont: OntologySnapshot, index: OntologyIndex, t: int) -> Sense:
+    """
+    Decode the Sense of one ontology type from a snapshot.
+    :param ont: The snapshot.
+    :param index: Its index.
+    :param t: The type id.
+    :return:
+    """
+    name = f'ont::{ont.name(t)}'
+    arguments, raw_features = ont.record(t)
+    roles = {}
+
+    # Capture information about roles
+    for role, optionality, raw_restrictions in arguments:
+        optional = optionality != 'REQUIRED'
+
+        restrictions = []
+        for raw in raw_restrictions:
+            r_type = RestrictionType.from_string(raw[0])
+            mask = 0
+            if r_type in (RestrictionType.TYPE, RestrictionType.TYPEQ) and raw[1] != Restriction._ALL_TYPES:
+                mask = index.mask(raw[1])
+            restrictions.append(Restriction(type=r_type, values=raw[1], type_mask=mask))
+
+        roles[role] = Role(role, optional, tuple(restrictions), PREDICATES.compile(restrictions))
+
+    # Copy the features over
+    features = {k: v for k, v in raw_features}
+    feature_set = frozenset((k, v.lower()) for k, v in raw_features if isinstance(v, str))
 
+    # Complete ancestry is precomputed by the index
+    return Sense(name, MappingProxyType(roles), MappingProxyType(features), index.ancestry(t),
+                 type_id=t, ancestors=index.closure(t), feature_set=feature_set)
@@ -0,0 +1,347 @@
+"""
+A compiled, memory-mapped snapshot of the parts of the TRIPS ontology used by the OntologyAdapter.
+
+Loading pytrips costs several seconds and a lot of memory per process, while the adapter only needs the word index,
+parent chains, role arguments with raw restrictions and sem features. This module compiles those into a versioned
+binary file once. Afterwards, lookups are answered straight from a memory map of that file.
+
+Snapshot layout (all integers little-endian):
+    header      magic, format version, metadata length
+    metadata    JSON describing the pytrips/jsontrips versions and data hash the snapshot was built from
+    directory   marshal'd (type names, parent ids, record offsets, word index)
+    records     one marshal'd (arguments, features) blob per type, decoded on demand
+
+:author: Sergey Goldobin
+:date: 07/21/2020
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from typing import *
+
+FORMAT_VERSION = 1
+
+_MAGIC = b'CRONTSNP'
+_HEADER = struct.Struct('<8sII')  # magic, format version, metadata length
+_DIR_LEN = struct.Struct('<Q')
+_ROOT = 'ont::root'
+_NO_PARENT = -1
+
+# Where the snapshot lives unless told otherwise. Can be overridden through the environment.
+_ENV_PATH = 'CR_ONTOLOGY_SNAPSHOT'
+_DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'constraint-resolver', 'ontology.snapshot')
+
+# Raw role arguments as stored in the snapshot: (role, optionality, raw restrictions)
+RawArgument = Tuple[str, str, Tuple[Tuple[str, Any], ...]]
+
+
+class SnapshotError(Exception):
+    """
+    A simple wrapper for exceptions caused by missing, corrupt or outdated snapshot files.
+    """
+    pass
+
+
+def _dist_version(dist: str) -> str:
+    """
+    Get the installed version of a distribution without importing it.
+    :param dist: Distribution name.
+    :return: Version string, or 'unknown' if it is not installed.
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # Python 3.7
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution(dist).version
+        except pkg_resources.DistributionNotFound:
+            return 'unknown'
+
+    try:
+        return version(dist)
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def _data_hash() -> str:
+    """
+    Fingerprint the ontology data files shipped with jsontrips.
+    The files weigh in at over a hundred megabytes, so hashing their contents on every startup would defeat the purpose
+    of the snapshot. Instead, the hash covers the name, size and modification time of each file.
+    :return: A hex digest, or 'unknown' if the data cannot be located.
+    """
+    spec = importlib.util.find_spec('jsontrips')
+    if spec is None or not spec.submodule_search_locations:
+        return 'unknown'
+
+    digest = hashlib.sha1()
+    for location in spec.submodule_search_locations:
+        data_dir = os.path.join(location, 'data')
+        if not os.path.isdir(data_dir):
+            continue
+        for name in sorted(os.listdir(data_dir)):
+            stat = os.stat(os.path.join(data_dir, name))
+            digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+
+    return digest.hexdigest()
+
+
+def current_fingerprint() -> Dict[str, Any]:
+    """
+    Describe the ontology that a fresh snapshot would be built from.
+    :return: A JSON-serializable dictionary.
+    """
+    return {
+        'format': FORMAT_VERSION,
+        'pytrips': _dist_version('pytrips'),
+        'jsontrips': _dist_version('jsontrips'),
+        'data_hash': _data_hash()
+    }
+
+
+def default_path() -> str:
+    """
+    Get the location of the snapshot file used when none is given explicitly.
+    :return:
+    """
+    return os.environ.get(_ENV_PATH, _DEFAULT_PATH)
+
+
+def compile_ontology(ont, fingerprint: Dict[str, Any] = None) -> bytes:
+    """
+    Compile a loaded pytrips ontology into the binary snapshot format.
+    :param ont: The result of pytrips.ontology.load()
+    :param fingerprint: Metadata to embed. Defaults to the current fingerprint.
+    :return: The complete contents of a snapshot file.
+    """
+    names = []  # type: List[str]
+    parents = array('i')
+    records = []  # type: List[bytes]
+    type_ids = {}  # type: Dict[str, int]
+
+    def register(t) -> int:
+        # Parents are registered before their children, so the type table is ordered top-down.
+        if t.name in type_ids:
+            return type_ids[t.name]
+
+        parent = t.parent
+        parent_id = _NO_PARENT if (parent is None or parent == _ROOT) else register(parent)
+
+        arguments = []
+        for r in t.arguments:
+            raw = tuple(sorted(r.getRawRestrictions(), key=repr))
+            arguments.append((r.role, str(r.optionality), raw))
+        features = tuple(t.sem.features.items())
+
+        type_ids[t.name] = len(names)
+        names.append(t.name)
+        parents.append(parent_id)
+        records.append(marshal.dumps((tuple(arguments), features)))
+        return type_ids[t.name]
+
+    words = {}  # type: Dict[str, Tuple[int, ...]]
+    for word in sorted(set(ont.all_words)):
+        ids = tuple(register(t) for t in ont.get_word(word))
+        if ids:
+            words[word] = ids
+
+    offsets = array('Q')
+    position = 0
+    for rec in records:
+        offsets.extend((position, len(rec)))
+        position += len(rec)
+
+    metadata = json.dumps(fingerprint or current_fingerprint(), sort_keys=True).encode()
+    directory = marshal.dumps((tuple(names), parents.tobytes(), offsets.tobytes(), words))
+
+    return b''.join([_HEADER.pack(_MAGIC, FORMAT_VERSION, len(metadata)), metadata,
+                     _DIR_LEN.pack(len(directory)), directory] + records)
+
+
+def build_snapshot(path: str = None) -> str:
+    """
+    Load the full pytrips ontology and write a fresh snapshot of it. This is the slow path.
+    The file is replaced atomically, so concurrent readers never observe a partial snapshot.
+    :param path: Destination file. Defaults to default_path().
+    :return: The path written.
+    """
+    import pytrips.ontology as trips
+
+    path = path or default_path()
+    fingerprint = current_fingerprint()
+    data = compile_ontology(trips.load(), fingerprint)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return path
+
+
+class OntologySnapshot:
+    """
+    Read-only access to a compiled ontology snapshot.
+    """
+
+    def __init__(self, path: str):
+        """
+        Memory-map a snapshot file.
+        :param path: Path to a file produced by build_snapshot()
+        :raises SnapshotError: If the file is not a readable snapshot of the current format.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, fmt, meta_len = _HEADER.unpack_from(self._buf, 0)
+            if magic != _MAGIC or fmt != FORMAT_VERSION:
+                raise SnapshotError(f'{path} is not a version {FORMAT_VERSION} ontology snapshot.')
+
+            cursor = _HEADER.size
+            self.metadata = json.loads(self._buf[cursor:cursor + meta_len].decode())
+            cursor += meta_len
+
+            dir_len, = _DIR_LEN.unpack_from(self._buf, cursor)
+            cursor += _DIR_LEN.size
+            names, parents, offsets, words = marshal.loads(self._buf[cursor:cursor + dir_len])
+            self._records_start = cursor + dir_len
+        except (struct.error, ValueError, EOFError, TypeError) as e:
+            self._buf.close()
+            raise SnapshotError(f'Corrupt ontology snapshot {path}: {e}')
+
+        self._names = names  # type: Tuple[str, ...]
+        self._parents = array('i')
+        self._parents.frombytes(parents)
+        self._offsets = array('Q')
+        self._offsets.frombytes(offsets)
+        self._words = words  # type: Dict[str, Tuple[int, ...]]
+
+    def __len__(self):
+        return len(self._names)
+
+    def close(self) -> NoReturn:
+        self._buf.close()
+
+    def is_current(self) -> bool:
+        """
+        Check whether this snapshot was built from the currently installed ontology.
+        :return:
+        """
+        return self.metadata == current_fingerprint()
+
+    @staticmethod
+    def normalize_word(word: str) -> str:
+        """
+        Bring a word to the form used by the word index. Mirrors Trips.get_word().
+        :param word:
+        :return:
+        """
+        return word.split('w::')[-1].lower()
+
+    def types_for(self, word: str) -> Tuple[int, ...]:
+        """
+        Look up the ids of all ontology types a word may denote.
+        :param word: The word to look up.
+        :return: A tuple of type ids.
+        """
+        return self._words.get(OntologySnapshot.normalize_word(word), ())
+
+    def words(self) -> Iterable[str]:
+        """
+        Get every word in the word index, normalized.
+        :return:
+        """
+        return self._words.keys()
+
+    def name(self, type_id: int) -> str:
+        """
+        Get the bare name of a type, i.e. 'phys-object' for ont::phys-object.
+        :param type_id:
+        :return:
+        """
+        return self._names[type_id]
+
+    def parent(self, type_id: int) -> int:
+        """
+        Get the id of a type's parent, or -1 if the parent is the ontology root.
+        :param type_id:
+        :return:
+        """
+        return self._parents[type_id]
+
+    def ancestry(self, type_id: int) -> List[str]:
+        """
+        Get the names of all ancestors of a type in ascending order, excluding the type itself and the root.
+        :param type_id:
+        :return:
+        """
+        result = []
+        cursor = self._parents[type_id]
+        while cursor != _NO_PARENT:
+            result.append(self._names[cursor])
+            cursor = self._parents[cursor]
+        return result
+
+    def record(self, type_id: int) -> Tuple[Tuple[RawArgument, ...], Tuple[Tuple[str, Any], ...]]:
+        """
+        Decode the role arguments and sem features of a type.
+        :param type_id:
+        :return: A tuple of (role arguments, feature pairs)
+        """
+        offset, length = self._offsets[2 * type_id], self._offsets[2 * type_id + 1]
+        start = self._records_start + offset
+        return marshal.loads(self._buf[start:start + length])
+
+
+def load_snapshot(path: str = None) -> OntologySnapshot:
+    """
+    Open the ontology snapshot, (re)building it first if it is missing or was built from a different ontology.
+    :param path: Snapshot file. Defaults to default_path().
+    :return: An OntologySnapshot.
+    """
+    path = path or default_path()
+
+    if os.path.exists(path):
+        try:
+            snapshot = OntologySnapshot(path)
+            if snapshot.is_current():
+                return snapshot
+            snapshot.close()
+        except SnapshotError as e:
+            print(f'Discarding ontology snapshot: {e}')
+
+    print(f'Building ontology snapshot at {path}. This only happens once per ontology version.')
+    return OntologySnapshot(build_snapshot(path))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compile the TRIPS ontology into a snapshot for fast startup.')
+    arg_parser.add_argument('-o', '--output', default=None, help=f'Snapshot file. Defaults to {default_path()}')
+    arg_parser.add_argument('-f', '--force', action='store_true', help='Rebuild even if the snapshot is current.')
+    args = arg_parser.parse_args()
+
+    out = args.output or default_path()
+    if args.force or not os.path.exists(out):
+        build_snapshot(out)
+    else:
+        load_snapshot(out).close()
+
+    snap = OntologySnapshot(out)
+    print(f'{out}: {len(snap)} types, built from {snap.metadata}')
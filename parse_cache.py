@@ -0,0 +1,178 @@
+"""
+A persistent, content-addressed cache of TRIPS parser replies.
+
+Each reply is stored compressed in its own file, named by a hash of the normalized sentence and the parser it came
+from. Files are written to a temporary name and renamed into place, so readers in other threads or processes never see
+a partial entry. Hits refresh a file's modification time, and the least recently used files are evicted once the
+cache outgrows its size limit.
+
+:author: Sergey Goldobin
+:date: 08/03/2020
+"""
+
+import hashlib
+import os
+import tempfile
+import zlib
+from typing import *
+
+_SUFFIX = '.xml.z'
+
+
+def normalize_sentence(sentence: str) -> str:
+    """
+    Bring a sentence to a canonical form for caching: surrounding whitespace stripped, inner runs collapsed.
+    Case is preserved, since the parser may treat capitalized words as names.
+    :param sentence:
+    :return:
+    """
+    return ' '.join(sentence.split())
+
+
+class ParseCache:
+    """
+    An on-disk map of (normalized sentence, parser URL, parser version) -> parser reply.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024, parser_version: str = ''):
+        """
+        Open (or create) a cache directory.
+        :param directory: Where to keep the cache. May be shared between processes.
+        :param max_bytes: Size limit for the compressed entries. Older entries are evicted beyond it.
+        :param parser_version: An optional tag for the parser deployment. Changing it invalidates old entries.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.parser_version = parser_version
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # type: Optional[int]  # Approximate total size, computed on first write
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Counters and the size estimate are per process.
+        return {'directory': self.directory, 'max_bytes': self.max_bytes, 'parser_version': self.parser_version}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def key(self, sentence: str, url: str) -> str:
+        """
+        Compute the content address of a sentence's parse.
+        :param sentence: The sentence as given to the parser.
+        :param url: The parser endpoint.
+        :return: A hex digest.
+        """
+        material = '\0'.join([normalize_sentence(sentence), url, self.parser_version])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Shard by the first byte of the key to keep directories small.
+        return os.path.join(self.directory, key[:2], key + _SUFFIX)
+
+    def get(self, sentence: str, url: str) -> Optional[str]:
+        """
+        Look up a cached parser reply.
+        :param sentence: The sentence as given to the parser.
+        :param url: The parser endpoint.
+        :return: The reply XML, or None on a miss.
+        """
+        path = self._path(self.key(sentence, url))
+        try:
+            with open(path, 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            # Missing, being evicted concurrently, or damaged. All are misses.
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass  # A read-only or shared cache, or evicted since reading. The reply is still good.
+
+        self.hits += 1
+        return data.decode('utf-8')
+
+    def put(self, sentence: str, url: str, reply: str) -> NoReturn:
+        """
+        Store a parser reply.
+        :param sentence: The sentence as given to the parser.
+        :param url: The parser endpoint.
+        :param reply: The reply XML.
+        :return:
+        """
+        path = self._path(self.key(sentence, url))
+        data = zlib.compress(reply.encode('utf-8'))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> Iterator[Tuple[str, int, float]]:
+        """
+        List all cache entries.
+        :return: A generator of (path, size, last use time)
+        """
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(_SUFFIX):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self, target: float = 0.9) -> int:
+        """
+        Delete the least recently used entries until the cache fits in a fraction of its size limit.
+        :param target: The fraction of max_bytes to shrink to, leaving headroom before the next eviction.
+        :return: The number of entries removed.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        size = sum(e[1] for e in entries)
+        removed = 0
+
+        for path, entry_size, _ in entries:
+            if size <= self.max_bytes * target:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass  # Another process got there first
+            size -= entry_size
+
+        self._size = size
+        return removed
+
+    def clear(self) -> NoReturn:
+        """
+        Delete every entry.
+        :return:
+        """
+        for path, _, _ in list(self._entries()):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
@@ -7,15 +7,30 @@ CS 799.06 Independent Study, RIT
 """
 
 import argparse
-import pytrips.ontology as ont
+import collections
+import functools
+import heapq
+import itertools
+import multiprocessing
+import operator
+import threading
+from dataclasses import dataclass, field
 from enum import Enum
 from trips_parser import TripsAPI
+from instrumentation import INSTRUMENTS, HistogramSink, PrometheusFileSink
+from stack_profiler import StackProfiler
+from parse_cache import ParseCache
+from trips_fixtures import FixtureStore
 from logical_form import LogicalForm
 from typing import *
 
-from ontology_adapter import OntologyAdapter, Sense, Restriction, RestrictionType
+from ontology_adapter import OntologyAdapter, OntologyView, Sense, Role, Restriction, Predicate, PREDICATES, \
+    MATCH_MEMO
+from bitset_engine import BitsetEngine, SenseBatch
 
-MAX_ID_RANGE = 1000
+# Fuzzy mode penalties per violated restriction. A sense of the wrong type is a worse fit than one missing a feature.
+TYPE_PENALTY = 2
+FEATURE_PENALTY = 1
 
 
 class ResolveType(Enum):
@@ -33,74 +48,314 @@ class ResolveType(Enum):
         raise ValueError(f'Invalid ResolveType {string}')
 
 
-# Type alias for type variables
-T_Var = str
+class MatchEngine(Enum):
+    """
+    Implementations of restriction matching.
+    """
+    SCALAR = "scalar"  # One matches_predicate call per (role, sense) pair
+    BITSET = "bitset"  # NumPy bitset engine, all senses of a role at once
+    CHECK = "check"  # Run both and fail loudly if they disagree
+
+    @staticmethod
+    def parse(string: str):
+        for t in MatchEngine:
+            if t.value == string:
+                return t
+        raise ValueError(f'Invalid MatchEngine {string}')
 
-# Relations can be unary or binary
-Relation = Union[T_Var, Tuple[T_Var, T_Var]]
 
-# A binding is an assignment of a type variable to a concrete sense
-Binding = Tuple[T_Var, str]
+# Type variables are dense integer ids, numbered per sentence from 0. Results refer to them by label.
+T_Var = int
 
-# An assignment of one type var with all corresponding matching assignments of another.
-Assignment = Tuple[Binding, T_Var, List[str]]
+# A binding is an assignment of a type variable, by label, to a concrete sense
+Binding = Tuple[str, str]
 
+# The same assignment by type variable id, as used while resolving
+SenseRef = Tuple[T_Var, str]
 
-class Resolver:
+
+@dataclass
+class ResolveResult:
     """
-    A collection of state and behaviors for a semantic resolver.
+    The outcome of resolving one sentence of a batch. Exactly one of 'bindings' (STRICT), 'interpretations' (FUZZY)
+    and 'error' is set.
     """
+    index: int  # Position of the sentence in the input
+    sentence: str
+    bindings: Optional[Dict[Binding, Dict[str, List[Binding]]]] = None
+    unsatisfied: Optional[Set[Tuple[Binding, str]]] = None
+    error: Optional[str] = None
 
-    def __init__(self):
-        self.relations = set()  # type: Set[Relation]
-        self.senses = {}  # type: Dict[T_Var, List[Sense]]
-        #  A mapping of (type var, sense) pairs to
-        self.bindings = {}  # type: Dict[Binding, Dict[str, List[Binding]]]
-        self.__seen_components = set()
+    interpretations: Optional[List['Interpretation']] = None  # FUZZY mode only
 
-        self._adapter = OntologyAdapter()
-        self._api = TripsAPI()
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
-    def _reset(self) -> NoReturn:
+
+@dataclass(frozen=True)
+class Interpretation:
+    """
+    One sense for every constrained type variable, scored by how badly it violates the selectional restrictions.
+    """
+    penalty: int  # Total penalty of all violations. 0 means every required role is filled.
+    # The chosen sense of each type variable, by label. A plain dict, so that results can be sent between processes.
+    senses: Mapping[str, str]
+    violations: Tuple[Tuple[Binding, str, int], ...]  # (parent binding, role, penalty) for every unfilled role
+
+
+@dataclass
+class ResolutionContext:
+    """
+    The state of resolving one sentence. Every resolution gets a fresh context, so a single Resolver keeps no
+    per-sentence state and can serve several requests at once.
+    Everything about a type variable is stored in lists indexed by its id.
+    """
+    labels: List[str] = field(default_factory=list)  # A readable name of each type variable, e.g. PUT_0
+    words: List[str] = field(default_factory=list)  # The word each type variable stands for
+    senses: List[Sequence[Sense]] = field(default_factory=list)
+    # The relation graph as adjacency lists: every type variable's related children, and the reverse
+    children: List[List[T_Var]] = field(default_factory=list)
+    parents: List[List[T_Var]] = field(default_factory=list)
+    #  A mapping of (type var, sense) pairs to the child bindings that fit each of the sense's roles
+    bindings: Dict[Binding, Dict[str, List[Binding]]] = field(default_factory=dict)
+    interpretations: List[Interpretation] = field(default_factory=list)  # FUZZY mode results
+    unsatisfied: Set[Tuple[Binding, str]] = field(default_factory=set)
+    seen_components: Set[LogicalForm.Component] = field(default_factory=set)
+    tvars: Dict[str, T_Var] = field(default_factory=dict)  # Component id -> type variable
+
+    def tvar(self, comp: LogicalForm.Component) -> T_Var:
         """
-        Reset internal state.
+        Get the type variable of a word component, creating it with no senses on first use.
+        :param comp:
         :return:
         """
-        self.relations = set()
-        self.senses = {}
-        self.__seen_components = set()
+        t_var = self.tvars.get(comp.comp_id)
+        if t_var is None:
+            t_var = self.tvars[comp.comp_id] = len(self.labels)
+            self.labels.append(f'{comp.word[0].upper()}_{t_var}')
+            self.words.append(comp.word[0])
+            self.senses.append(())
+            self.children.append([])
+            self.parents.append([])
+        return t_var
+
+    def relate(self, parent: T_Var, child: T_Var) -> NoReturn:
+        """
+        Add a binary relation between two type variables.
+        :param parent:
+        :param child:
+        :return:
+        """
+        if child not in self.children[parent]:
+            self.children[parent].append(child)
+            self.parents[child].append(parent)
+
+    def groups(self) -> Iterator[Tuple[T_Var, List[T_Var]]]:
+        """
+        Iterate over the binary relations grouped by their left-hand side.
+        :return: A generator of (parent, children) for every type variable with related children.
+        """
+        # For example, if there are relations (V1, V2), (V1, V3), (V1, V4), then a satisfactory assignment is one where
+        # All required and any optional roles of V1 are occupied by some combination of V2, V3, and V4
+        for parent, children in enumerate(self.children):
+            if children:
+                yield parent, children
+
+
+class Resolver:
+    """
+    A collection of state and behaviors for a semantic resolver.
+    """
+
+    def __init__(self, engine: MatchEngine = MatchEngine.SCALAR, api: TripsAPI = None,
+                 ontology: Union[OntologyAdapter, OntologyView] = None):
+        """
+        Create a resolver.
+        :param engine: How to match child senses against role restrictions.
+        :param api: The TRIPS parser interface to use, with its endpoint, parse cache and recording settings.
+            Defaults to the public parser with no cache.
+        :param ontology: Where to look up word senses. An OntologyView can be shared by any number of Resolvers and
+            threads. Defaults to a new OntologyAdapter.
+        """
+        self._adapter = ontology or OntologyAdapter()
+        self._api = api or TripsAPI()
+
+        self._engine = engine
+        self._bitset = None
+        if engine is not MatchEngine.SCALAR:
+            self._bitset = BitsetEngine(len(self._adapter.index))
 
     def resolve(self, sentence: str, mode: ResolveType, count: int = None):
         """
         Given a sentence, produce all valid semantic interpretations up to 'count'
         :param sentence: The sentence to resolve.
         :param mode: STRICT or FUZZY resolution.
-        :param count: The number of interpretations to show.
-        :return: A list of assignments and a success indicator.
+        :param count: The number of interpretations to show. In FUZZY mode, defaults to 1.
+        :return: STRICT: all allowable bindings and the roles that could not be satisfied.
+            FUZZY: the 'count' lowest-penalty Interpretations, best first, and the roles violated by the best one.
         """
-        self._reset()
+        ctx = self.resolve_context(sentence, mode, count)
+        if mode is ResolveType.FUZZY:
+            return ctx.interpretations, ctx.unsatisfied
+        return ctx.bindings, ctx.unsatisfied
 
+    def resolve_context(self, sentence: str, mode: ResolveType, count: int = None) -> ResolutionContext:
+        """
+        Like resolve, but return the whole state of the resolution, e.g. for iter_interpretations.
+        :param sentence: The sentence to resolve.
+        :param mode: STRICT or FUZZY resolution.
+        :param count: The number of interpretations to find in FUZZY mode.
+        :return:
+        """
         # The following steps are involved:
         # 1) Obtain a logical form of the sentence
         lf = self._api.parse(sentence)
+        return self.resolve_lf(lf, mode, count)
+
+    def resolve_lf(self, lf: LogicalForm, mode: ResolveType, count: int = None) -> ResolutionContext:
+        """
+        Resolve an already parsed sentence.
+        :param lf: The sentence's LogicalForm.
+        :param mode: STRICT or FUZZY resolution.
+        :param count: The number of interpretations to find in FUZZY mode.
+        :return: A new context holding the results. Nothing about the sentence is kept on the Resolver.
+        """
+        ctx = ResolutionContext()
 
         # 2) Obtain a set of unary and binary relations represented in the logical form
-        self._get_relations_and_senses(lf)  # Stored in the Resolver's state
-        for t_var, senses in self.senses.items():
+        self._get_relations_and_senses(ctx, lf)
+        for t_var, senses in enumerate(ctx.senses):
             if not senses:
-                print(f'No senses found for {t_var}')
+                print(f'No senses found for {ctx.labels[t_var]}')
+
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('sense_lookups', len(ctx.senses))
+            INSTRUMENTS.count('candidates', sum(len(senses) for senses in ctx.senses))
 
         # 3) Check the constraints imposed by those relations against the selectional restrictions. Discard any invalid
         # interpretations and store the valid ones.
-        bad_roles = self._satisfy_constraints(mode)
+        ctx.unsatisfied = self._satisfy_constraints(ctx, mode, count)
 
-        return self.bindings, bad_roles
+        if INSTRUMENTS.enabled and mode is ResolveType.STRICT:
+            INSTRUMENTS.count('bindings', sum(len(fits) for roles in ctx.bindings.values() for fits in roles.values()))
+        return ctx
 
-    def _get_relations_and_senses(self, lf: LogicalForm):
+    def iter_interpretations(self, ctx: ResolutionContext, count: int = None) -> Iterator[Interpretation]:
+        """
+        Generate complete, consistent sense assignments for a resolved sentence, one at a time.
+        An assignment is consistent if every required specific role of every chosen parent sense is filled by the
+        chosen sense of one of its children. Type variables without any senses are left out.
+        The search backtracks over one type variable at a time, always taking the one with the fewest senses left
+        that are consistent with the choices made so far, so dead ends are found early. Nothing is computed beyond
+        the assignments actually consumed.
+        :param ctx: The resolved sentence, from resolve_context or resolve_lf in STRICT mode.
+        :param count: Stop after this many assignments. None for all of them.
+        :return: A generator of Interpretations with no violations.
+        """
+        if count is not None and count < 1:
+            return
+
+        variables = [v for v, senses in enumerate(ctx.senses) if senses]
+
+        # For every parent and sense index: for each required specific role, the (child, sense index) pairs fitting it.
+        required = [[] for _ in ctx.senses]  # type: List[List[List[FrozenSet[Tuple[T_Var, int]]]]]
+        for parent, children in ctx.groups():
+            batch = self._encode_children(ctx, children)
+            index_of = {(c, s.name): (c, i) for c in children for i, s in enumerate(ctx.senses[c])}
+            for p_sense in ctx.senses[parent]:
+                required[parent].append([
+                    frozenset(index_of[b] for b in self._fitting_children(ctx, r, children, batch))
+                    for r in p_sense.roles.values() if r.is_specific() and not r.optional
+                ])
+
+        # The sense index chosen for every type variable, or None.
+        assignment = [None] * len(ctx.senses)  # type: List[Optional[int]]
+
+        def fillable(parent):
+            # Every required role of the parent's sense can still be filled, given the children chosen so far.
+            for fitting in required[parent][assignment[parent]]:
+                if not any(assignment[c] is None or assignment[c] == i for c, i in fitting):
+                    return False
+            return True
+
+        def consistent(var):
+            return all(fillable(p) for p in [var] + ctx.parents[var] if required[p] and assignment[p] is not None)
+
+        def values(var):
+            result = []
+            for i in range(len(ctx.senses[var])):
+                assignment[var] = i
+                if consistent(var):
+                    result.append(i)
+            assignment[var] = None
+            return result
+
+        def search(left):
+            if not left:
+                yield
+                return
+
+            # The most constrained variable first.
+            candidates, var = min(((values(v), v) for v in left), key=lambda o: (len(o[0]), o[1]))
+            rest = [v for v in left if v != var]
+            for i in candidates:
+                assignment[var] = i
+                yield from search(rest)
+            assignment[var] = None
+
+        for produced, _ in enumerate(search(variables), 1):
+            senses = {ctx.labels[v]: ctx.senses[v][assignment[v]].name for v in variables}
+            yield Interpretation(0, senses, ())
+            if produced == count:
+                return
+
+    def resolve_many(self, sentences: Iterable[str], mode: ResolveType, count: int = None, workers: int = None,
+                     ordered: bool = True, chunksize: int = 1) -> Iterator[ResolveResult]:
+        """
+        Resolve a batch of sentences on a pool of worker processes.
+        Where the platform supports fork, workers inherit this Resolver with its ontology snapshot, caches and memo
+        tables already loaded. Elsewhere, each worker builds its own Resolver once, with the same engine, parser
+        interface and kind of ontology, mapped from the same snapshot.
+        :param sentences: The sentences to resolve.
+        :param mode: STRICT or FUZZY resolution.
+        :param count: The number of interpretations to show per sentence.
+        :param workers: Number of worker processes. Defaults to the CPU count. 1 resolves in this process.
+        :param ordered: If True, results are yielded in input order. Otherwise, as soon as they complete.
+        :param chunksize: Number of sentences handed to a worker at a time.
+        :return: A generator of ResolveResults. A failure in one sentence is reported on its result only.
+        """
+        global _worker_resolver
+        jobs = ((i, sentence, mode, count) for i, sentence in enumerate(sentences))
+
+        if workers == 1:
+            for job in jobs:
+                yield _resolve_job(job, self)
+            return
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+        # Inherited by the workers forked now. Other threads setting up pools must not swap it out meanwhile.
+        with _worker_lock:
+            _worker_resolver = self
+            try:
+                pool = context.Pool(workers, initializer=_init_worker,
+                                    initargs=(self._engine, self._api, self._adapter))
+            finally:
+                _worker_resolver = None
+
+        with pool:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for result in imap(_resolve_job, jobs, chunksize):
+                yield result
+
+    def _get_relations_and_senses(self, ctx: ResolutionContext, lf: LogicalForm):
         """
         Navigate a given logicalForm tree to obtain:
-        1) A set of relations between all components of the tree represented as type variables.
-        2) A mapping of type variables to all possible senses and corresponding restrictions.
+        1) The relations between all components of the tree represented as type variables.
+        2) The possible senses and corresponding restrictions of every type variable.
+        :param ctx: The resolution in progress.
         :param lf: A LogicalForm representation of a sentence.
         :return:
         """
@@ -111,151 +366,422 @@ class Resolver:
         if root is None:
             return
 
-        self.__rel_rest_help(root)
+        self.__rel_rest_help(ctx, root)
 
-    def __rel_rest_help(self, comp):
+    def __rel_rest_help(self, ctx: ResolutionContext, comp):
         """
         Recursive helper function for relation and restriction search.
+        :param ctx: The resolution in progress.
         :return:
         """
         # This is a leaf component with no word. Base case.
         if isinstance(comp, str) or (not comp.word and not comp.roles[0]):
             return
 
-        if comp in self.__seen_components:
+        if comp in ctx.seen_components:
             return
-        self.__seen_components.add(comp)
+        ctx.seen_components.add(comp)
 
         t_var = None
-        # If this component represents a word, create a unique type variable and a unary relation.
+        # If this component represents a word, it gets a unique type variable: a unary relation.
         if comp.word:
-            t_var = Resolver.get_tvar(comp)
-            self.relations.add(t_var)
+            t_var = ctx.tvar(comp)
 
             # Look up the senses and restrictions for this word
-            senses = self._adapter.get_senses(comp.word[0])
-            self.senses[t_var] = senses
+            ctx.senses[t_var] = self._adapter.get_senses(comp.word[0])
 
         # If this component has any children that represent concrete words, they form binary relations
         for cs in comp.roles[0].values():
             child = cs[0]
 
             # If the child AND this node represent a concrete word, form a binary relation.
-            if not isinstance(child, str) and child.word and t_var:
-                child_t_var = Resolver.get_tvar(child)
-                self.relations.add((t_var, child_t_var))
+            if not isinstance(child, str) and child.word and t_var is not None:
+                ctx.relate(t_var, ctx.tvar(child))
 
             # Finally, recurse on the child
-            self.__rel_rest_help(child)
+            self.__rel_rest_help(ctx, child)
 
-    def _satisfy_constraints(self, mode: ResolveType) -> Set[Tuple[Binding, str]]:
+    @INSTRUMENTS.timed('satisfy')
+    def _satisfy_constraints(self, ctx: ResolutionContext, mode: ResolveType, count: int = None) \
+            -> Set[Tuple[Binding, str]]:
         """
         Given a set of relations between type variables and a set of type variable senses/constraints, generate all
         satisfying assignments of senses.
+        :param ctx: The resolution in progress.
         :param mode: strict or fuzzy matching
+        :param count: The number of interpretations to find in FUZZY mode.
         :return:
         """
         # Algorithm is adapted from NLU by J. Allen, p.299
         if mode is ResolveType.FUZZY:
-            raise NotImplementedError('Fuzzy matching not yet supported.')
+            ctx.interpretations = self._fuzzy_interpretations(ctx, 1 if count is None else count)
+            if not ctx.interpretations:
+                return set()
+            return {(binding, role) for binding, role, _ in ctx.interpretations[0].violations}
 
-        # Relations must be considered in groups of matching left-hand side
-        # For example, if there are relations (V1, V2), (V1, V3), (V1, V4), then a satisfactory assignment is one where
-        # All required and any optional roles of V1 are occupied by some combination of V2, V3, and V4
-        groups = {}
-        unsatisfied_roles = set()
-        for rel in self.relations:
-            if not isinstance(rel, tuple):
-                continue
-            v1, v2 = rel
-            if v1 not in groups:
-                groups[v1] = []
-            groups[v1].append(v2)
+        # Shrink every type variable's senses to those that can take part in some satisfying assignment.
+        unsatisfied_roles = self._propagate(ctx)
+        labels = ctx.labels
 
-        for parent, children in groups.items():
+        # Relations must be considered in groups of matching left-hand side
+        for parent, children in ctx.groups():
             # We must find all combinations of children that fill required slots on the parent.
-            p_senses = self.senses[parent]
+            p_senses = ctx.senses[parent]
+
+            # The bitset engine encodes every candidate child sense once per group.
+            batch = self._encode_children(ctx, children)
 
             # For every sense of the parent
             for p_sense in p_senses:
                 # Gather all roles with specific restrictions
                 relevant_roles = list(filter(lambda r: r.is_specific(), p_sense.roles.values()))
-                key = (parent, p_sense.name)
-                if key not in self.bindings:
-                    self.bindings[key] = {}
+                key = (labels[parent], p_sense.name)
+                if key not in ctx.bindings:
+                    ctx.bindings[key] = {}
 
                 # For every role with restrictions on the parent
                 for r in relevant_roles:
-                    # For every right-hand-side child
-                    fitting_children = []
-                    for c in children:
-                        c_senses = self.senses[c]
-                        # Get all the child's senses that fit the role
-                        matches = list(filter(lambda s: self.matches_restrictions(s, r.restrictions), c_senses))
-                        fitting_children.extend((c, s.name) for s in matches)
+                    fitting_children = self._fitting_children(ctx, r, children, batch)
 
                     if not r.optional and not fitting_children:
                         unsatisfied_roles.add((key, r.role))
 
-                    if r.role not in self.bindings[key]:
-                        self.bindings[key][r.role] = []
-                    self.bindings[(parent, p_sense.name)][r.role].extend(fitting_children)
-
-                # There were no wildcard or required roles on a sense and all of them are unsatisfied, then so is the
-                # sense
-                if len(self.bindings[(parent, p_sense.name)]) == len(p_sense.roles):
-                    if all(not matches for _, matches in self.bindings[(parent, p_sense.name)].items()):
-                        unsatisfied_roles.add(((parent, p_sense.name), 'ALL'))
+                    if r.role not in ctx.bindings[key]:
+                        ctx.bindings[key][r.role] = []
+                    ctx.bindings[key][r.role].extend((labels[c], name) for c, name in fitting_children)
 
         # Once all relations have been examined, we have a complete set of allowable bindings.
         return unsatisfied_roles
 
-    @staticmethod
-    def matches_restrictions(s: Sense, rs: List[Restriction]) -> bool:
+    def _encode_children(self, ctx: ResolutionContext, children: List[T_Var]) -> Optional[SenseBatch]:
         """
-        Test whether the given sense matches a provided list of restrictions.
-        :param s: A Sense to match
-        :param rs: Restrictions to match against
-        :return: True if the Sense satisfies the Restrictions, False otherwise.
+        Encode the current senses of a parent's children for the bitset engine.
+        :param ctx: The resolution in progress.
+        :param children: Type variables related to the parent.
+        :return: None with the SCALAR engine.
+        """
+        if self._bitset is None:
+            return None
+        labels = [(c, s.name) for c in children for s in ctx.senses[c]]
+        return self._bitset.encode(labels, [s for c in children for s in ctx.senses[c]])
+
+    def _propagate(self, ctx: ResolutionContext) -> Set[Tuple[Binding, str]]:
         """
-        # The sense matches restrictions if every individual restriction is satisfied.
-        for r in rs:
-            if r.type in [RestrictionType.TYPE, RestrictionType.TYPEQ]:
-                # The type of this sense must match at least one within the restriction list.
-                # The type does not have to match exactly. A matching ancestor is acceptable.
-                # For example, if the restriction calls for a phys-obj and the sense is a car, it passes.
+        Make the sense domains in ctx.senses arc consistent (AC-3), pruning them in place to a fixpoint:
+        1) A parent sense is removed if one of its required specific roles fits no remaining sense of any child.
+        2) A parent sense is also removed if it has no wildcard roles and none of its roles fit any child. This
+           includes senses without roles: they cannot relate to the children at all.
+        3) A child sense is removed if it fits no role of any remaining sense of a parent. Parent senses with a
+           wildcard role accept every child, and a parent with no senses left constrains none.
+        Every removal can invalidate senses of neighbouring type variables, which are then checked again.
+        :param ctx: The resolution in progress.
+        :return: Why each sense was removed, in the same form as unsatisfied roles: a ((type var, sense), role) pair
+            for a parent sense, ((type var, sense), 'ALL') for one that fits no child, and
+            ((type var, sense), 'PARENT <type var>') for a child sense.
+        """
+        labels = ctx.labels
+        removed = set()
+        queue = collections.deque(parent for parent, _ in ctx.groups())
+        queued = [False] * len(labels)
+        for parent in queue:
+            queued[parent] = True
+        while queue:
+            parent = queue.popleft()
+            queued[parent] = False
+            children = ctx.children[parent]
+            batch = self._encode_children(ctx, children)
+
+            # Keep the parent senses whose required roles can all be filled, and note which child senses they accept.
+            kept = []
+            supported = set()  # type: Set[SenseRef]
+            accepts_any = False
+            for p_sense in ctx.senses[parent]:
+                fits = []
+                failed = None
+                for r in p_sense.roles.values():
+                    if not r.is_specific():
+                        continue
+                    fitting = self._fitting_children(ctx, r, children, batch)
+                    if not fitting and not r.optional:
+                        failed = r.role
+                        break
+                    fits.append(fitting)
 
-                # Trips uses a 'type' constant to indicate a wildcard, matching anything
-                if r.wildcard:
+                # There were no wildcard or required roles on a sense and all of them are unsatisfied, then so is the
+                # sense
+                if failed is None and len(fits) == len(p_sense.roles) and not any(fits):
+                    failed = 'ALL'
+
+                if failed is not None:
+                    removed.add(((labels[parent], p_sense.name), failed))
                     continue
+                kept.append(p_sense)
+                if len(fits) < len(p_sense.roles):
+                    accepts_any = True  # A wildcard role
+                for fitting in fits:
+                    supported.update(fitting)
+
+            changed = []
+            if len(kept) < len(ctx.senses[parent]):
+                ctx.senses[parent] = tuple(kept)
+                changed.append(parent)
+
+            # A parent without senses is left out of every interpretation, so it does not constrain its children.
+            if kept and not accepts_any:
+                for c in children:
+                    c_senses = [s for s in ctx.senses[c] if (c, s.name) in supported]
+                    if len(c_senses) < len(ctx.senses[c]):
+                        removed.update(((labels[c], s.name), f'PARENT {labels[parent]}') for s in ctx.senses[c]
+                                       if (c, s.name) not in supported)
+                        ctx.senses[c] = tuple(c_senses)
+                        changed.append(c)
+
+            # Revisit every other group the shrunk domains take part in. This group is consistent already: the child
+            # senses it removed were not needed by any of its remaining senses.
+            for var in changed:
+                for neighbour in ([var] if ctx.children[var] else []) + ctx.parents[var]:
+                    if neighbour != parent and not queued[neighbour]:
+                        queue.append(neighbour)
+                        queued[neighbour] = True
+
+        return removed
 
-                anc_overlap = list(filter(lambda x: x in r.values, s.ancestry))
-                if (s.name not in r.values) and (not anc_overlap):
-                    # Neither this sense nor its ancestry matched up to the restriction.
-                    return False
-            elif r.type is RestrictionType.FEATURES:
-                # The set of features represented in the restriction must be a proper subset of sense features.
-                for f_name, f_val in r.values:
-                    if not isinstance(f_val, str):
+    @staticmethod
+    def _penalty(p: Predicate, s: Sense) -> int:
+        """
+        Score how badly a sense fails a role's restrictions.
+        :param p: The role's compiled restrictions.
+        :param s: The candidate sense.
+        :return: 0 if the sense fits.
+        """
+        types, features = p.violations(s)
+        return TYPE_PENALTY * types + FEATURE_PENALTY * features
+
+    def _fuzzy_interpretations(self, ctx: ResolutionContext, count: int) -> List[Interpretation]:
+        """
+        Find the 'count' interpretations with the lowest total penalty.
+        Every required role with specific restrictions on a parent's chosen sense costs the penalty of the best fitting
+        child's chosen sense, or the penalty of every restriction if no child can fill it. Type variables are assigned
+        one at a time in a best-first search, ordered by a lower bound on the penalty of any completion. The bound is
+        exact once all variables are assigned, so complete interpretations leave the queue in order of penalty, and the
+        search stops after the first 'count' of them without enumerating the rest.
+        :param ctx: The resolution in progress.
+        :param count: The number of interpretations to return.
+        :return: Interpretations, lowest penalty first.
+        """
+        if count < 1:
+            return []
+
+        # Only variables that take part in a relation and have senses are constrained.
+        variables = {v for parent, children in ctx.groups() for v in [parent] + children if ctx.senses[v]}
+        # Variables with fewer senses first: their choices narrow the bound sooner.
+        variables = sorted(variables, key=lambda v: (len(ctx.senses[v]), v))
+        if not variables:
+            return []
+
+        # For every parent, sense, and required specific role: the role's penalty when unfilled, and the penalty of
+        # every sense of every child that could fill it.
+        costs = {}  # type: Dict[T_Var, List[List[Tuple[str, int, List[Tuple[T_Var, List[int], int]]]]]]
+        checks = 0
+        for parent, children in ctx.groups():
+            if not ctx.senses[parent]:
+                continue
+            children = [c for c in children if ctx.senses[c]]
+            costs[parent] = []
+            for p_sense in ctx.senses[parent]:
+                roles = []
+                for r in p_sense.roles.values():
+                    if r.optional or not r.is_specific() or r.predicate.trivial:
                         continue
-                    if f_name not in s.features:
-                        # A required feature is missing
-                        return False
-                    if s.features[f_name].lower() != f_val.lower():
-                        # Value mismatch for required feature.
-                        return False
+                    unfilled = TYPE_PENALTY * len(r.predicate.type_masks) + \
+                        FEATURE_PENALTY * len(r.predicate.features)
+                    options = []
+                    for c in children:
+                        c_costs = [Resolver._penalty(r.predicate, s) for s in ctx.senses[c]]
+                        options.append((c, c_costs, min(c_costs)))
+                        checks += len(c_costs)
+                    roles.append((r.role, unfilled, options))
+                costs[parent].append(roles)
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('restriction_checks', checks)
+
+        def role_cost(unfilled, options, assignment):
+            # An unassigned child could still take its best fitting sense.
+            return min([c_costs[assignment[c]] if c in assignment else best for c, c_costs, best in options],
+                       default=unfilled)
+
+        def sense_cost(roles, assignment):
+            return sum(role_cost(unfilled, options, assignment) for _, unfilled, options in roles)
+
+        def bound(assignment):
+            total = 0
+            for parent, sense_costs in costs.items():
+                if parent in assignment:
+                    total += sense_cost(sense_costs[assignment[parent]], assignment)
+                else:
+                    total += min(sense_cost(roles, assignment) for roles in sense_costs)
+            return total
+
+        # Queue entries are (lower bound, -depth, tie breaker, sense indices of the first len(...) variables). Among
+        # equal bounds the deepest assignment comes first, so it is completed before its siblings are expanded.
+        tie = itertools.count()
+        queue = [(bound({}), 0, next(tie), ())]
+        results = []
+        while queue and len(results) < count:
+            penalty, _, _, chosen = heapq.heappop(queue)
+            if len(chosen) == len(variables):
+                results.append(self.__interpretation(ctx, variables, chosen, costs, penalty))
+                continue
 
-        # Made it to the end with no failures ==> Match
-        return True
+            var = variables[len(chosen)]
+            for i in range(len(ctx.senses[var])):
+                extended = chosen + (i,)
+                heapq.heappush(queue, (bound(dict(zip(variables, extended))), -len(extended), next(tie), extended))
 
-    @staticmethod
-    def get_tvar(comp):
+        return results
+
+    def __interpretation(self, ctx: ResolutionContext, variables: List[T_Var], chosen: Tuple[int, ...], costs: Dict,
+                         penalty: int) -> Interpretation:
         """
-        Get the name of a type variable from a component.
-        :param comp:
+        Describe a complete assignment found by _fuzzy_interpretations.
+        :param ctx: The resolution in progress.
+        :param variables: The constrained type variables, in search order.
+        :param chosen: The sense index of every variable.
+        :param costs: The penalty tables of the search.
+        :param penalty: The assignment's total penalty.
         :return:
         """
-        return f'{comp.word[0].upper()}_{hash(comp.comp_id) % MAX_ID_RANGE}'
+        assignment = dict(zip(variables, chosen))
+        violations = []
+        for parent, sense_costs in costs.items():
+            p_name = ctx.senses[parent][assignment[parent]].name
+            for role, unfilled, options in sense_costs[assignment[parent]]:
+                cost = min([c_costs[assignment[c]] for c, c_costs, _ in options], default=unfilled)
+                if cost:
+                    violations.append(((ctx.labels[parent], p_name), role, cost))
+
+        senses = {ctx.labels[v]: ctx.senses[v][i].name for v, i in sorted(assignment.items())}
+        return Interpretation(penalty, senses, tuple(sorted(violations)))
+
+    def _fitting_children(self, ctx: ResolutionContext, role: Role, children: List[T_Var],
+                          batch: Optional[SenseBatch]) -> List[SenseRef]:
+        """
+        Find every child sense that fits a role, using the configured matching engine.
+        :param ctx: The resolution in progress.
+        :param role: The parent's role to fill.
+        :param children: Type variables related to the parent.
+        :param batch: The children's senses encoded by the bitset engine, unless the engine is SCALAR.
+        :return: (type var, sense name) pairs in child order.
+        """
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.count('restriction_checks', sum(len(ctx.senses[c]) for c in children))
+
+        if self._engine is MatchEngine.BITSET:
+            return self._bitset.matching_labels(role, batch)
+
+        # For every right-hand-side child
+        fitting_children = []
+        for c in children:
+            c_senses = ctx.senses[c]
+            # Get all the child's senses that fit the role
+            matches = list(filter(lambda s: self.matches_predicate(s, role.predicate), c_senses))
+            fitting_children.extend((c, s.name) for s in matches)
+
+        if self._engine is MatchEngine.CHECK:
+            vectorized = self._bitset.matching_labels(role, batch)
+            if vectorized != fitting_children:
+                raise RuntimeError(f'Matching engines disagree on role {role.role}: '
+                                   f'scalar {fitting_children}, bitset {vectorized}')
+
+        return fitting_children
+
+    @staticmethod
+    def matches_restrictions(s: Sense, rs: Sequence[Restriction]) -> bool:
+        """
+        Test whether the given sense matches a provided list of restrictions.
+        :param s: A Sense to match
+        :param rs: Restrictions to match against, with their type masks filled in, as on a Role
+        :return: True if the Sense satisfies the Restrictions, False otherwise.
+        """
+        return Resolver.matches_predicate(s, PREDICATES.compile(rs))
+
+    @staticmethod
+    def matches_predicate(s: Sense, p: Predicate) -> bool:
+        """
+        Test whether the given sense matches a role's compiled restrictions.
+        :param s: A Sense to match
+        :param p: The role's Predicate to match against
+        :return: True if the Sense satisfies the Restrictions, False otherwise.
+        """
+        # The sense matches if its type (or an ancestor) is allowed by every TYPE/TYPEQ restriction and it carries all
+        # required feature values. Trips uses a 'type' constant to indicate a wildcard; those compile to nothing.
+        if p.trivial:
+            return True
+
+        # The same verb-role/noun-sense pairs recur across sentences, so results are memoized process-wide.
+        return MATCH_MEMO.matches(s, p)
+
+
+# The Resolver of a pool worker process. Set by resolve_many while forking so that the workers inherit it.
+_worker_resolver = None  # type: Optional[Resolver]
+_worker_lock = threading.Lock()
+
+
+def _init_worker(engine: MatchEngine, api: TripsAPI, ontology: Union[OntologyAdapter, OntologyView]) -> NoReturn:
+    """
+    Pool initializer. Workers forked while resolve_many set up the pool already hold the parent's Resolver; spawned
+    ones, and workers the pool starts later to replace others, build their own.
+    :param engine: The parent Resolver's matching engine.
+    :param api: The parent Resolver's TRIPS parser interface.
+    :param ontology: The parent Resolver's ontology. Spawned workers receive it as its snapshot path.
+    :return:
+    """
+    global _worker_resolver
+    if _worker_resolver is None:
+        _worker_resolver = Resolver(engine, api, ontology)
+
+
+def _resolve_job(job: Tuple[int, str, ResolveType, Optional[int]], resolver: Resolver = None) -> ResolveResult:
+    """
+    Resolve one sentence, capturing any error in the result.
+    :param job: A tuple of (index, sentence, mode, count)
+    :param resolver: The Resolver to use. Defaults to the pool worker's.
+    :return:
+    """
+    index, sentence, mode, count = job
+    try:
+        result, unsatisfied = (resolver or _worker_resolver).resolve(sentence, mode, count)
+        if mode is ResolveType.FUZZY:
+            return ResolveResult(index, sentence, unsatisfied=unsatisfied, interpretations=result)
+        return ResolveResult(index, sentence, result, unsatisfied)
+    except Exception as e:
+        return ResolveResult(index, sentence, error=f'{type(e).__name__}: {e}')
+
+
+def _print_pipeline_stats(resolver: Resolver, ctx: ResolutionContext, stats: HistogramSink) -> NoReturn:
+    """
+    Describe the work done by a profiled resolution.
+    :param resolver: The Resolver that did it.
+    :param ctx: The resolved sentence.
+    :param stats: A sink that observed the resolution.
+    :return:
+    """
+    counters = stats.counters()
+    print('\nPipeline statistics:')
+    for stage, timer in stats.timers().items():
+        print(f'\t{stage}: {timer.count} calls, {1000 * timer.total:.3f}ms')
+    print(f'\tRestriction checks: {counters.get("restriction_checks", 0)}')
+
+    # STRICT resolution prunes the senses in place, so look up how many there were to begin with.
+    found = [len(resolver._adapter.get_senses(word)) for word in ctx.words]
+    print('\tSenses per type variable (found -> after pruning):')
+    for label, n, senses in zip(ctx.labels, found, ctx.senses):
+        print(f'\t\t{label}: {n} -> {len(senses)}')
+
+    # Type variables without senses are left out of every interpretation.
+    before = functools.reduce(operator.mul, (n for n in found if n), 1)
+    after = functools.reduce(operator.mul, (len(senses) for senses in ctx.senses if senses), 1)
+    print(f'\tCandidate cross product: {before} -> {after}')
 
 
 def main():
@@ -269,13 +795,106 @@ def main():
     argp.add_argument("-m", "--mode", choices=[t.value for t in ResolveType], required=True, type=str,
                       help="Strictness of the algorithm.\n\tstrict\tRequires all semantic restrictions to match.\n"
                            "fuzzy\tAllows for some mismatch. Shows 'n' least mismatching interpretations.")
+    argp.add_argument("-n", "--count", type=int, default=None,
+                      help="Number of interpretations to show. Fuzzy mode shows the single best one by default. "
+                           "In strict mode, also list this many complete sense assignments.")
+    argp.add_argument("-e", "--engine", choices=[e.value for e in MatchEngine], default=MatchEngine.SCALAR.value,
+                      type=str, help="Restriction matching implementation. 'check' runs both and compares them.")
+    argp.add_argument("-c", "--parse-cache", metavar="DIR", default=None,
+                      help="Keep TRIPS parser replies in this directory and reuse them for repeated sentences.")
+    argp.add_argument("--parse-cache-size", metavar="MB", type=int, default=256,
+                      help="Size limit of the parse cache in megabytes.")
+    argp.add_argument("-u", "--trips-url", metavar="URL", default=None,
+                      help="TRIPS parser endpoint, e.g. a local trips_standin.py server.")
+    argp.add_argument("-r", "--record", metavar="DIR", default=None,
+                      help="Record every reply obtained from the parser into this fixture directory.")
+    argp.add_argument("--metrics", metavar="FILE", default=None,
+                      help="Write stage timings and counters to this file in the Prometheus text format.")
+    argp.add_argument("--profile", metavar="FILE", default=None,
+                      help="Profile the resolution: write its call stacks to this file in the collapsed format read "
+                           "by flamegraph tools, and print the hottest functions and pipeline statistics.")
+    argp.add_argument("--profile-top", metavar="N", type=int, default=20,
+                      help="Number of functions in the profile summary.")
+    argp.add_argument("-s", "--server", metavar="ADDRESS", default=None,
+                      help="Resolve on a running resolver_server.py instead: its http://host:port URL or Unix socket. "
+                           "The server's own options decide how it parses and matches, so the options that configure "
+                           "local resolution cannot be combined with this one.")
     args = argp.parse_args()
+    if args.server:
+        local = [option for option, given in [('-e/--engine', args.engine != MatchEngine.SCALAR.value),
+                                              ('-c/--parse-cache', args.parse_cache),
+                                              ('-u/--trips-url', args.trips_url),
+                                              ('-r/--record', args.record),
+                                              ('--metrics', args.metrics),
+                                              ('--profile', args.profile)] if given]
+        if local:
+            argp.error(f'{", ".join(local)} cannot be combined with --server')
     args.mode = ResolveType.parse(args.mode)  # The IDE warning is lying
+    args.engine = MatchEngine.parse(args.engine)
 
     print(f'Resolving sentence: {args.sentence}\nMode: {args.mode.value}')
 
-    resolver = Resolver()
-    bindings, errors = resolver.resolve(args.sentence, args.mode)
+    if args.server:
+        # Imported here: the server module is built on this one.
+        from resolver_server import ResolverClient, decode_result
+        reply = ResolverClient(args.server).resolve(args.sentence, args.mode, args.count)
+        _print_results(args.mode, *decode_result(reply), args.count)
+        return
+
+    parse_cache = None
+    if args.parse_cache:
+        parse_cache = ParseCache(args.parse_cache, args.parse_cache_size * 1024 * 1024)
+    record = FixtureStore(args.record) if args.record else None
+
+    metrics = INSTRUMENTS.add_sink(PrometheusFileSink(args.metrics)) if args.metrics else None
+
+    resolver = Resolver(args.engine, TripsAPI(args.trips_url, parse_cache, record))
+
+    if args.profile:
+        stats = INSTRUMENTS.add_sink(HistogramSink())
+        with StackProfiler() as profiler:
+            ctx = resolver.resolve_context(args.sentence, args.mode, args.count)
+        INSTRUMENTS.remove_sink(stats)
+
+        with open(args.profile, 'w') as f:
+            profiler.write_collapsed(f)
+        print(f'\nCall stacks written to {args.profile}\nHottest functions:')
+        print(profiler.format_summary(args.profile_top))
+        _print_pipeline_stats(resolver, ctx, stats)
+    else:
+        ctx = resolver.resolve_context(args.sentence, args.mode, args.count)
+
+    if metrics is not None:
+        metrics.flush()
+
+    interpretations = ctx.interpretations
+    if args.mode is ResolveType.STRICT:
+        interpretations = list(resolver.iter_interpretations(ctx, args.count)) if args.count else None
+    _print_results(args.mode, ctx.bindings, ctx.unsatisfied, interpretations, args.count)
+
+
+def _print_results(mode: ResolveType, bindings: Dict[Binding, Dict[str, List[Binding]]],
+                   errors: Set[Tuple[Binding, str]], interpretations: Optional[List[Interpretation]],
+                   count: Optional[int]) -> NoReturn:
+    """
+    Display the result of a resolution.
+    :param mode: The resolution mode.
+    :param bindings: STRICT bindings. Unsatisfied senses are removed from them.
+    :param errors: Unsatisfied roles.
+    :param interpretations: FUZZY interpretations, or complete STRICT ones if a count was given.
+    :param count: The number of interpretations requested.
+    :return:
+    """
+    if mode is ResolveType.FUZZY:
+        for rank, interp in enumerate(interpretations, 1):
+            print(f'\nInterpretation {rank}, penalty {interp.penalty}:')
+            for t_var, sense in sorted(interp.senses.items()):
+                print(f'\t{t_var} -> {sense}')
+            for binding, role, penalty in interp.violations:
+                print(f'\tViolated: {binding} {role} (+{penalty})')
+        if not interpretations:
+            print('No constrained type variables to interpret.')
+        return
 
     if errors:
         print('Failed to find a satisfying assignment for the following senses:')
@@ -299,6 +918,13 @@ def main():
             print(f'\tUnsatisfiable roles: {impossible_roles}')
         print(f'\tANY sense of other components for all other roles')
 
+    if count:
+        print(f'\nComplete interpretations (up to {count}):')
+        for rank, interp in enumerate(interpretations, 1):
+            print(f'{rank}. ' + ', '.join(f'{t_var} -> {sense}' for t_var, sense in interp.senses.items()))
+        if not interpretations:
+            print('None')
+
 
 if __name__ == '__main__':
     main()
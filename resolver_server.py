@@ -0,0 +1,336 @@
+"""
+A resident resolver daemon, so that resolving a sentence does not pay for interpreter startup and ontology loading.
+
+The server loads one Resolver and shares it between concurrent requests, over localhost HTTP or HTTP on a Unix socket:
+    POST /resolve   {"sentence": "...", "mode": "strict", "count": null}
+                    or {"xml": "<TRIPS reply>", ...} to skip the parser. A count is null or a positive integer.
+    GET  /health    {"status": "ok"}
+Replies are JSON. A resolution is described by:
+    bindings        [{"type_var": "PUT_0", "sense": "ont::put", "roles": {"agent": [["BOX_1", "ont::box"], ...]}}]
+    unsatisfied     [{"type_var": "ON_2", "sense": "ont::on", "role": "figure"}]
+    interpretations [{"penalty": 0, "senses": {"PUT_0": "ont::put", ...}, "violations": [{"type_var", "sense", "role",
+                    "penalty"}]}]. In STRICT mode, only present if a count was given.
+Errors are {"error": "..."} with a 4xx or 5xx status.
+
+ResolverClient talks to a running server, and resolver.py uses it with --server.
+
+:author: Sergey Goldobin
+:date: 08/14/2020
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+
+from logical_form import LogicalForm
+from ontology_adapter import OntologyAdapter
+from parse_cache import ParseCache
+from resolver import Resolver, ResolveType, MatchEngine, ResolutionContext, Interpretation, Binding
+from trips_parser import TripsAPI
+
+
+def encode_result(resolver: Resolver, ctx: ResolutionContext, mode: ResolveType, count: Optional[int]) -> Dict:
+    """
+    Describe a resolution as JSON-compatible data.
+    :param resolver: The Resolver that did it, for STRICT interpretations.
+    :param ctx: The resolved sentence.
+    :param mode: The resolution mode.
+    :param count: The number of interpretations requested.
+    :return:
+    """
+    result = {
+        'bindings': [{'type_var': t_var, 'sense': sense, 'roles': {role: [list(b) for b in fits]
+                                                                  for role, fits in roles.items()}}
+                     for (t_var, sense), roles in ctx.bindings.items()],
+        'unsatisfied': [{'type_var': t_var, 'sense': sense, 'role': role}
+                        for (t_var, sense), role in sorted(ctx.unsatisfied)]
+    }
+
+    interpretations = ctx.interpretations
+    if mode is ResolveType.STRICT:
+        interpretations = list(resolver.iter_interpretations(ctx, count)) if count else None
+    if interpretations is not None:
+        result['interpretations'] = [
+            {'penalty': i.penalty, 'senses': dict(i.senses),
+             'violations': [{'type_var': t_var, 'sense': sense, 'role': role, 'penalty': penalty}
+                            for (t_var, sense), role, penalty in i.violations]}
+            for i in interpretations
+        ]
+    return result
+
+
+def decode_result(data: Dict) -> Tuple[Dict[Binding, Dict[str, List[Binding]]], Set[Tuple[Binding, str]],
+                                       Optional[List[Interpretation]]]:
+    """
+    Rebuild the result of a resolution from its JSON description.
+    :param data: A reply of the server.
+    :return: Bindings, unsatisfied roles, and interpretations if there were any, as Resolver produces them.
+    """
+    bindings = {(b['type_var'], b['sense']): {role: [tuple(f) for f in fits] for role, fits in b['roles'].items()}
+                for b in data['bindings']}
+    unsatisfied = {((u['type_var'], u['sense']), u['role']) for u in data['unsatisfied']}
+
+    interpretations = None
+    if 'interpretations' in data:
+        interpretations = [
+            Interpretation(i['penalty'], i['senses'],
+                           tuple(((v['type_var'], v['sense']), v['role'], v['penalty']) for v in i['violations']))
+            for i in data['interpretations']
+        ]
+    return bindings, unsatisfied, interpretations
+
+
+class _ResolveHandler(BaseHTTPRequestHandler):
+    """
+    Answers resolution requests with the server's shared Resolver. Every request runs on its own thread.
+    """
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._reply(404, {'error': f'No such resource {self.path}'})
+            return
+        self._reply(200, {'status': 'ok'})
+
+    def do_POST(self):
+        if self.path != '/resolve':
+            self._reply(404, {'error': f'No such resource {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            mode = ResolveType.parse(request.get('mode', ResolveType.STRICT.value))
+            count = request.get('count')
+            if count is not None and (not isinstance(count, int) or isinstance(count, bool) or count < 1):
+                raise ValueError(f'Expected a positive integer count, got {count!r}')
+            sentence, xml_str = request.get('sentence'), request.get('xml')
+            if (sentence is None) == (xml_str is None):
+                raise ValueError('Expected exactly one of "sentence" and "xml"')
+        except (ValueError, AttributeError) as e:
+            self._reply(400, {'error': f'Bad request: {e}'})
+            return
+
+        resolver = self.server.resolver
+        try:
+            if xml_str is not None:
+                ctx = resolver.resolve_lf(LogicalForm(xml_str, backend=resolver._api.backend), mode, count)
+            else:
+                ctx = resolver.resolve_context(sentence, mode, count)
+            result = encode_result(resolver, ctx, mode, count)
+        except Exception as e:
+            self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._reply(200, result)
+
+    def _reply(self, status: int, body: Dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket peers have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ResolverServer(ThreadingHTTPServer):
+    """
+    A multi-threaded HTTP server resolving sentences with one shared Resolver.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, resolver: Resolver, host: str = '127.0.0.1', port: int = 0, verbose: bool = False):
+        """
+        Bind the server. Call serve_forever() or start() to begin answering requests.
+        :param resolver: The Resolver to share between requests.
+        :param host: Interface to bind.
+        :param port: Port to bind. 0 picks a free one; see address.
+        :param verbose: Log every request to stderr.
+        """
+        super().__init__((host, port), _ResolveHandler)
+        self.resolver = resolver
+        self.verbose = verbose
+
+    @property
+    def address(self) -> str:
+        """
+        The address to hand to ResolverClient.
+        :return:
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> threading.Thread:
+        """
+        Serve requests on a background thread. Stop with shutdown().
+        :return: The serving thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class UnixResolverServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A ResolverServer listening on a Unix socket instead of a TCP port.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, resolver: Resolver, path: str, verbose: bool = False):
+        """
+        Bind the server, replacing any stale socket file.
+        :param resolver: The Resolver to share between requests.
+        :param path: The socket file to create.
+        :param verbose: Log every request to stderr.
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _ResolveHandler)
+        self.resolver = resolver
+        self.verbose = verbose
+
+    @property
+    def address(self) -> str:
+        return self.server_address
+
+    def start(self) -> threading.Thread:
+        """
+        Serve requests on a background thread. Stop with shutdown().
+        :return: The serving thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    An HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ResolverClient:
+    """
+    Sends resolution requests to a running ResolverServer.
+    """
+
+    def __init__(self, address: str, timeout: float = 60.0):
+        """
+        Create a client. No connection is made until the first request.
+        :param address: An http://host:port URL, or the path of a Unix socket.
+        :param timeout: Seconds to wait for a reply.
+        """
+        self.address = address
+        self.timeout = timeout
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.address.startswith('http://'):
+            host_port = self.address[len('http://'):].rstrip('/')
+            return http.client.HTTPConnection(host_port, timeout=self.timeout)
+        return _UnixHTTPConnection(self.address, self.timeout)
+
+    def _request(self, method: str, path: str, body: Dict = None) -> Dict:
+        conn = self._connect()
+        try:
+            data = json.dumps(body).encode('utf-8') if body is not None else None
+            conn.request(method, path, data, {'Content-Type': 'application/json'})
+            reply = conn.getresponse()
+            result = json.loads(reply.read().decode('utf-8'))
+        finally:
+            conn.close()
+
+        if reply.status != 200:
+            raise RuntimeError(f'Resolver server replied {reply.status}: {result.get("error")}')
+        return result
+
+    def health(self) -> bool:
+        """
+        Check that the server is up.
+        :return:
+        """
+        try:
+            return self._request('GET', '/health').get('status') == 'ok'
+        except (OSError, RuntimeError):
+            return False
+
+    def resolve(self, sentence: str = None, mode: ResolveType = ResolveType.STRICT, count: int = None,
+                xml: str = None) -> Dict:
+        """
+        Resolve a sentence, or an already parsed TRIPS reply, on the server.
+        :param sentence: The sentence to resolve.
+        :param mode: STRICT or FUZZY resolution.
+        :param count: The number of interpretations to find.
+        :param xml: A TRIPS parser reply, instead of a sentence.
+        :return: The server's reply; see decode_result.
+        """
+        request = {'mode': mode.value, 'count': count}
+        if xml is not None:
+            request['xml'] = xml
+        else:
+            request['sentence'] = sentence
+        return self._request('POST', '/resolve', request)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serve semantic resolution requests from a resident Resolver.')
+    arg_parser.add_argument("-p", "--port", type=int, default=8043, help="Port to listen on.")
+    arg_parser.add_argument("--host", default='127.0.0.1', help="Interface to listen on.")
+    arg_parser.add_argument("-s", "--socket", metavar="PATH", default=None,
+                            help="Listen on this Unix socket instead of a TCP port.")
+    arg_parser.add_argument("-e", "--engine", choices=[e.value for e in MatchEngine], default=MatchEngine.SCALAR.value,
+                            help="Restriction matching implementation.")
+    arg_parser.add_argument("-u", "--trips-url", metavar="URL", default=None, help="TRIPS parser endpoint.")
+    arg_parser.add_argument("-c", "--parse-cache", metavar="DIR", default=None,
+                            help="Keep TRIPS parser replies in this directory and reuse them for repeated sentences.")
+    arg_parser.add_argument("--parse-cache-size", metavar="MB", type=int, default=256,
+                            help="Size limit of the parse cache in megabytes.")
+    arg_parser.add_argument("--freeze", action='store_true',
+                            help="Decode the whole ontology up front, so requests look up senses without locking. "
+                                 "New restriction match results are still stored under a brief lock.")
+    arg_parser.add_argument("-v", "--verbose", action='store_true', help="Log every request.")
+    args = arg_parser.parse_args()
+
+    parse_cache = ParseCache(args.parse_cache, args.parse_cache_size * 1024 * 1024) if args.parse_cache else None
+    ontology = OntologyAdapter()
+    resolver = Resolver(MatchEngine.parse(args.engine), TripsAPI(args.trips_url, parse_cache),
+                        ontology.freeze() if args.freeze else ontology)
+
+    if args.socket:
+        server = UnixResolverServer(resolver, args.socket, args.verbose)
+    else:
+        server = ResolverServer(resolver, args.host, args.port, args.verbose)
+    print(f'Serving resolution requests at {server.address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
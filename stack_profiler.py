@@ -0,0 +1,133 @@
+"""
+A deterministic profiler that records the full call stack of every function call.
+
+Unlike cProfile, which only keeps caller -> callee pairs, it attributes time to complete stacks, so its output can be
+drawn as a flame graph. Stacks are written in the collapsed format read by flamegraph.pl, speedscope and similar tools:
+one line per distinct stack, frames separated by semicolons, followed by the self time spent in it in microseconds.
+The same data also gives per-function call counts and self and total times.
+
+Only the thread that starts the profiler is profiled. Every call is intercepted, so profiled code runs several times
+slower than usual; compare timings between profiled runs only.
+
+:author: Sergey Goldobin
+:date: 08/13/2020
+"""
+
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import *
+
+_clock = time.perf_counter
+
+
+@dataclass(frozen=True)
+class FunctionStats:
+    """
+    The totals of one function over a profiled run.
+    """
+    name: str
+    calls: int
+    self_time: float  # Seconds spent in the function itself
+    total_time: float  # Seconds spent in the function and everything it called
+
+
+class StackProfiler:
+    """
+    Records time per call stack while running. Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self):
+        self._stack = []  # type: List[List]  # [stack path, frame name, start time, time spent in callees]
+        self._folded = {}  # type: Dict[str, float]  # stack path -> self time
+        self._calls = {}  # type: Dict[str, int]
+        self._self_time = {}  # type: Dict[str, float]
+        self._total_time = {}  # type: Dict[str, float]
+        self._active = {}  # type: Dict[str, int]  # Frames of each function on the stack, to count recursion once
+        self._names = {}  # type: Dict[Any, str]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self) -> NoReturn:
+        sys.setprofile(self._event)
+
+    def stop(self) -> NoReturn:
+        sys.setprofile(None)
+        # Close the frames that are still running, e.g. the caller of start().
+        now = _clock()
+        while self._stack:
+            self._pop(now)
+
+    def _name(self, key, make: Callable[[], str]) -> str:
+        name = self._names.get(key)
+        if name is None:
+            # Frame names must not contain the separators of the collapsed format.
+            name = self._names[key] = make().replace(';', ':').replace(' ', '_')
+        return name
+
+    def _event(self, frame, event: str, arg) -> NoReturn:
+        now = _clock()
+        if event == 'call':
+            code = frame.f_code
+            name = self._name(code, lambda: f'{os.path.basename(code.co_filename)}:'
+                                            f'{getattr(code, "co_qualname", code.co_name)}:{code.co_firstlineno}')
+        elif event == 'c_call':
+            name = self._name(arg, lambda: f'<built-in>:{getattr(arg, "__qualname__", repr(arg))}')
+        elif self._stack:  # return, c_return or c_exception
+            self._pop(now)
+            return
+        else:
+            return  # A frame that was running before the profiler started
+
+        path = f'{self._stack[-1][0]};{name}' if self._stack else name
+        self._stack.append([path, name, now, 0.0])
+        self._calls[name] = self._calls.get(name, 0) + 1
+        self._active[name] = self._active.get(name, 0) + 1
+
+    def _pop(self, now: float) -> NoReturn:
+        path, name, start, in_callees = self._stack.pop()
+        elapsed = now - start
+        self._folded[path] = self._folded.get(path, 0.0) + elapsed - in_callees
+        self._self_time[name] = self._self_time.get(name, 0.0) + elapsed - in_callees
+        self._active[name] -= 1
+        if not self._active[name]:
+            self._total_time[name] = self._total_time.get(name, 0.0) + elapsed
+        if self._stack:
+            self._stack[-1][3] += elapsed
+
+    def write_collapsed(self, stream: TextIO) -> NoReturn:
+        """
+        Write every recorded stack in the collapsed format.
+        :param stream: A text stream.
+        :return:
+        """
+        for path, seconds in sorted(self._folded.items()):
+            micros = round(seconds * 1e6)
+            if micros > 0:
+                stream.write(f'{path} {micros}\n')
+
+    def functions(self) -> List[FunctionStats]:
+        """
+        Get the totals of every function called.
+        :return: Functions by descending self time.
+        """
+        stats = [FunctionStats(name, calls, self._self_time.get(name, 0.0), self._total_time.get(name, 0.0))
+                 for name, calls in self._calls.items()]
+        return sorted(stats, key=lambda f: (-f.self_time, f.name))
+
+    def format_summary(self, top: int = 20) -> str:
+        """
+        Describe the functions with the most self time as a table.
+        :param top: How many functions to list.
+        :return:
+        """
+        lines = [f'{"calls":>10}{"self ms":>12}{"total ms":>12}  function']
+        for f in self.functions()[:top]:
+            lines.append(f'{f.calls:>10}{1000 * f.self_time:>12.3f}{1000 * f.total_time:>12.3f}  {f.name}')
+        return '\n'.join(lines)
@@ -0,0 +1,185 @@
+"""
+A library of command templates that finds the ones matching a LogicalForm without comparing it against every template.
+
+Templates are indexed on the attributes of their root component: indicator, type, word and the role names required by
+all of its rolegroups. An empty indicator, type or word in a template is a wildcard, so such templates are kept in a
+separate wildcard bucket for that attribute. Each bucket is an int bitmask over template positions, and the candidates
+for an LF are the intersection of the buckets its root selects. Only the candidates go through full matching.
+
+:author: Sergey Goldobin
+:date: 08/10/2020
+"""
+
+import os
+from typing import *
+
+from logical_form import LogicalForm
+
+# The root attributes a template is indexed on. Each maps a component to the values it is filed under.
+_KEYS = {
+    'indicator': lambda c: c.indicator,
+    'type': lambda c: c.comp_type,
+    'word': lambda c: c.word or ()
+}
+
+
+def _bits(mask: int) -> Iterator[int]:
+    """
+    Iterate over the positions of set bits, lowest first.
+    :param mask:
+    :return:
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class TemplateLibrary:
+    """
+    An indexed collection of command templates.
+    Templates should be resolved before they are added: the index is built from the root component as it is then.
+    """
+
+    def __init__(self, templates: Iterable[LogicalForm] = ()):
+        """
+        Create a library.
+        :param templates: Initial templates, in priority order.
+        """
+        self._templates = []  # type: List[LogicalForm]
+        # For every attribute, the templates filed under each value, and the templates with a wildcard.
+        self._buckets = {key: {} for key in _KEYS}  # type: Dict[str, Dict[str, int]]
+        self._wildcards = {key: 0 for key in _KEYS}  # type: Dict[str, int]
+        # Templates by a role name every one of their rolegroups requires, and the templates requiring none.
+        self._role_buckets = {}  # type: Dict[str, int]
+        self._no_roles = 0
+        # Role sets of every rolegroup of every template, for the exact subset check.
+        self._role_sets = []  # type: List[Tuple[FrozenSet[str], ...]]
+
+        for t in templates:
+            self.add(t)
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Load every *.xml command template in a directory, in file name order.
+        :param directory:
+        :return:
+        """
+        templates = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.xml'):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    templates.append(LogicalForm(template=f.read()))
+        return cls(templates)
+
+    def __len__(self):
+        return len(self._templates)
+
+    def __iter__(self) -> Iterator[LogicalForm]:
+        return iter(self._templates)
+
+    def add(self, template: LogicalForm) -> int:
+        """
+        Add a template to the library. Templates added earlier take priority.
+        :param template:
+        :return: The position of the template in the library.
+        """
+        if not isinstance(template, LogicalForm):
+            raise ValueError(f'Expected {LogicalForm} argument, got {type(template)}.')
+
+        pos = len(self._templates)
+        bit = 1 << pos
+        root = template.get_tree()
+        self._templates.append(template)
+
+        for key, values_of in _KEYS.items():
+            values = values_of(root)
+            if not values:
+                self._wildcards[key] |= bit
+            for v in values:
+                self._buckets[key][v] = self._buckets[key].get(v, 0) | bit
+
+        role_sets = tuple(frozenset(rg.keys()) for rg in root.roles)
+        self._role_sets.append(role_sets)
+        required = frozenset.intersection(*role_sets)
+        if not required:
+            self._no_roles |= bit
+        else:
+            # Any one of the required roles is enough to rule the template out; file it under the rarest one.
+            role = min(sorted(required), key=lambda r: bin(self._role_buckets.get(r, 0)).count('1'))
+            self._role_buckets[role] = self._role_buckets.get(role, 0) | bit
+
+        return pos
+
+    def _candidate_mask(self, root: LogicalForm.Component) -> int:
+        """
+        Find the templates whose root could match a component.
+        :param root: The root component of an LF.
+        :return: A bitmask over template positions.
+        """
+        mask = (1 << len(self._templates)) - 1
+
+        for key, values_of in _KEYS.items():
+            values = values_of(root)
+            if not values:
+                continue  # A wildcard in the LF matches every template.
+            selected = self._wildcards[key]
+            buckets = self._buckets[key]
+            for v in values:
+                selected |= buckets.get(v, 0)
+            mask &= selected
+            if not mask:
+                return 0
+
+        role_names = set()
+        for rg in root.roles:
+            role_names.update(rg.keys())
+        selected = self._no_roles
+        for r in role_names:
+            selected |= self._role_buckets.get(r, 0)
+        mask &= selected
+
+        # Exact check: some rolegroup of the template must only use roles one rolegroup of the LF has.
+        lf_sets = [set(rg.keys()) for rg in root.roles]
+        for pos in _bits(mask):
+            if not any(t_set <= lf_set for t_set in self._role_sets[pos] for lf_set in lf_sets):
+                mask ^= 1 << pos
+
+        return mask
+
+    def candidates(self, lf: LogicalForm) -> List[LogicalForm]:
+        """
+        Get the templates that pass the index for an LF. Every template that matches the LF is among them.
+        :param lf:
+        :return: Candidate templates in priority order.
+        """
+        root = lf.get_tree()
+        if root is None:
+            return []
+        return [self._templates[pos] for pos in _bits(self._candidate_mask(root))]
+
+    def match(self, lf: LogicalForm) -> List[Tuple[LogicalForm, Dict[str, str]]]:
+        """
+        Find every template that matches an LF.
+        :param lf: The command LF.
+        :return: A list of (template, bound parameters) in priority order.
+        """
+        matches = []
+        for template in self.candidates(lf):
+            matched, params = lf.match_template(template)
+            if matched:
+                matches.append((template, params))
+        return matches
+
+    def match_first(self, lf: LogicalForm) -> Optional[Tuple[LogicalForm, Dict[str, str]]]:
+        """
+        Find the highest priority template that matches an LF.
+        :param lf: The command LF.
+        :return: (template, bound parameters), or None if nothing matched.
+        """
+        for template in self.candidates(lf):
+            matched, params = lf.match_template(template)
+            if matched:
+                return template, params
+        return None
@@ -0,0 +1,59 @@
+"""
+Shared fixtures. The modules live at the repository root, and the ontology snapshot is built on first use
+(see ontology_snapshot.py; set CR_ONTOLOGY_SNAPSHOT to reuse an existing one).
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Recorded TRIPS replies in tests/data, by sentence.
+SENTENCES = {
+    'put the box on the table': 'put.xml',
+    'put the red box on the table': 'red_box.xml'
+}
+
+
+def read_data(name: str) -> str:
+    with open(os.path.join(DATA, name), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture(scope='session')
+def adapter():
+    from ontology_adapter import OntologyAdapter
+    return OntologyAdapter()
+
+
+@pytest.fixture(scope='session')
+def put_xml():
+    return read_data('put.xml')
+
+
+@pytest.fixture(scope='session')
+def red_box_xml():
+    return read_data('red_box.xml')
+
+
+@pytest.fixture(scope='session')
+def trips_url(tmp_path_factory):
+    """
+    A stand-in TRIPS parser serving the recorded replies.
+    """
+    from trips_fixtures import FixtureStore
+    from trips_standin import StandinServer
+
+    store = FixtureStore(str(tmp_path_factory.mktemp('fixtures')))
+    for sentence, name in SENTENCES.items():
+        store.put(sentence, read_data(name))
+
+    server = StandinServer(store)
+    server.start()
+    yield server.url
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,101 @@
+"""
+AsyncTripsAPI against local stand-ins for the TRIPS parser: result order, rejected sentences, timeouts and retries.
+"""
+
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import SENTENCES
+from trips_parser import TripsAPI
+
+pytest.importorskip('aiohttp')
+
+from async_trips_parser import AsyncTripsAPI, TripsAPIError
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    """
+    Answers each request with the next step of the server's script: an HTTP status, or 'slow' to stall
+    until the client has given up.
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            step = self.server.script.pop(0) if self.server.script else 200
+            self.server.requests += 1
+        if step == 'slow':
+            time.sleep(0.5)
+            self.close_connection = True
+            return  # The client has given up by now.
+        if step != 200:
+            self.send_error(step)
+            return
+
+        data = self.server.reply.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def scripted(put_xml):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ScriptedHandler)
+    server.daemon_threads = True
+    server.script, server.requests, server.reply, server.lock = [], 0, put_xml, threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = 'http://127.0.0.1:%d/parser/cgi/parse' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+async def parse_many(url, sentences, **kwargs):
+    async with AsyncTripsAPI(url, **kwargs) as api:
+        return await api.parse_many(sentences, return_exceptions=True)
+
+
+def test_results_in_input_order(trips_url):
+    sentences = (list(SENTENCES) + list(reversed(list(SENTENCES)))) * 4
+    found = asyncio.run(parse_many(trips_url, sentences, max_in_flight=3))
+
+    api = TripsAPI(trips_url)
+    assert [lf.pretty_format() for lf in found] == [api.parse(s).pretty_format() for s in sentences]
+
+
+def test_unrecorded_sentences_are_rejected(trips_url):
+    found = asyncio.run(parse_many(trips_url, ['put the box on the table', 'a sentence that was never recorded'],
+                                   retries=2, backoff=0.01))
+    assert found[0].pretty_format() == TripsAPI(trips_url).parse('put the box on the table').pretty_format()
+    assert isinstance(found[1], TripsAPIError)
+    assert 'HTTP 404' in str(found[1])
+
+
+def test_client_errors_are_not_retried(scripted):
+    scripted.script = [404]
+    found = asyncio.run(parse_many(scripted.url, ['put the box on the table'], retries=3, backoff=0.01))
+    assert isinstance(found[0], TripsAPIError)
+    assert scripted.requests == 1
+
+
+def test_server_errors_and_timeouts_are_retried(scripted):
+    scripted.script = [503, 'slow', 500]
+    found = asyncio.run(parse_many(scripted.url, ['put the box on the table'], retries=3, backoff=0.01, timeout=0.2))
+    assert scripted.requests == 4
+    assert found[0].pretty_format() == TripsAPI(scripted.url).parse('put the box on the table').pretty_format()
+
+
+def test_retries_run_out(scripted):
+    scripted.script = [503] * 3
+    found = asyncio.run(parse_many(scripted.url, ['put the box on the table'], retries=2, backoff=0.01))
+    assert isinstance(found[0], TripsAPIError)
+    assert 'after 3 attempts' in str(found[0]) and 'HTTP 503' in str(found[0])
+    assert scripted.requests == 3
@@ -0,0 +1,78 @@
+"""
+The bitset matching engine must agree with the scalar one on every role and every sentence.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bitset_engine import BitsetEngine
+from conftest import read_data
+from logical_form import LogicalForm
+from resolver import Resolver, ResolveType, MatchEngine
+
+pytest.importorskip('numpy')
+
+PARENTS = ['put', 'take', 'move', 'on', 'red', 'give']
+CHILDREN = ['box', 'table', 'red', 'person', 'water', 'idea', 'on']
+
+
+def test_every_role_matches_alike(adapter):
+    engine = BitsetEngine(len(adapter.index))
+    senses = [s for word in CHILDREN for s in adapter.get_senses(word)]
+    batch = engine.encode(list(range(len(senses))), senses)
+
+    roles = [r for word in PARENTS for p in adapter.get_senses(word) for r in p.roles.values()]
+    selective = 0
+    for role in roles:
+        expected = [i for i, s in enumerate(senses) if Resolver.matches_predicate(s, role.predicate)]
+        assert engine.matching_labels(role, batch) == expected, role
+        selective += 0 < len(expected) < len(senses)
+    assert selective
+
+
+def test_threads_share_an_engine(adapter):
+    engine = BitsetEngine(len(adapter.index))
+    values = [f'value-{i}' for i in range(2000)]
+    start = threading.Barrier(8)
+
+    def intern(offset):
+        start.wait()
+        return [engine.code(v) for v in values[offset:] + values[:offset]]
+
+    with ThreadPoolExecutor(8) as pool:
+        codes = list(pool.map(intern, range(0, 2000, 250)))
+    by_value = {engine.code(v): v for v in values}
+    assert sorted(by_value) == list(range(2000))
+    for offset, found in zip(range(0, 2000, 250), codes):
+        assert [by_value[c] for c in found] == values[offset:] + values[:offset]
+
+    senses = [s for word in CHILDREN for s in adapter.get_senses(word)]
+    roles = [r for word in PARENTS for p in adapter.get_senses(word) for r in p.roles.values()]
+    fresh = BitsetEngine(len(adapter.index))
+
+    def match(role):
+        start.wait()
+        return fresh.matching_labels(role, fresh.encode(list(range(len(senses))), senses))
+
+    start = threading.Barrier(8)
+    with ThreadPoolExecutor(8) as pool:
+        found = list(pool.map(match, roles[:len(roles) // 8 * 8]))
+    assert found == [[i for i, s in enumerate(senses) if role.predicate.evaluate(s)] for role in roles[:len(found)]]
+
+
+@pytest.mark.parametrize('mode, count', [(ResolveType.STRICT, None), (ResolveType.STRICT, 5), (ResolveType.FUZZY, 5)])
+@pytest.mark.parametrize('xml_name', ['put.xml', 'red_box.xml'])
+def test_engines_resolve_alike(adapter, xml_name, mode, count):
+    results = []
+    for engine in MatchEngine:
+        resolver = Resolver(engine, ontology=adapter)
+        ctx = resolver.resolve_lf(LogicalForm(read_data(xml_name)), mode, count)
+        interpretations = ctx.interpretations
+        if mode is ResolveType.STRICT and count:
+            interpretations = list(resolver.iter_interpretations(ctx, count))
+        results.append((ctx.bindings, ctx.unsatisfied, interpretations))
+
+    assert results[0][0] or results[0][2]
+    assert all(r == results[0] for r in results[1:])
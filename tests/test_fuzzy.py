@@ -0,0 +1,100 @@
+"""
+FUZZY resolution: the best-first search must return the same penalties as scoring every combination, without
+enumerating them.
+"""
+
+import functools
+import heapq
+import itertools
+import operator
+
+import pytest
+
+import resolver as resolver_module
+from logical_form import LogicalForm
+from resolver import Resolver, ResolveType, ResolutionContext, TYPE_PENALTY, FEATURE_PENALTY
+
+
+def make_context(r: Resolver, words, parents) -> ResolutionContext:
+    """
+    Relate each of the first 'parents' words to every other word.
+    """
+    ctx = ResolutionContext()
+    t_vars = [ctx.tvar(LogicalForm.Component(f'V{i}', word=w)) for i, w in enumerate(words)]
+    for t_var, word in zip(t_vars, words):
+        ctx.senses[t_var] = r._adapter.get_senses(word)
+    for parent in t_vars[:parents]:
+        for child in t_vars:
+            if child != parent:
+                ctx.relate(parent, child)
+    return ctx
+
+
+def brute_force_penalties(ctx: ResolutionContext):
+    variables = sorted({v for parent, children in ctx.groups() for v in [parent] + children if ctx.senses[v]})
+    penalties = []
+    for combo in itertools.product(*[range(len(ctx.senses[v])) for v in variables]):
+        chosen = dict(zip(variables, combo))
+        total = 0
+        for parent, children in ctx.groups():
+            if not ctx.senses[parent]:
+                continue
+            for role in ctx.senses[parent][chosen[parent]].roles.values():
+                if role.optional or not role.is_specific() or role.predicate.trivial:
+                    continue
+                unfilled = TYPE_PENALTY * len(role.predicate.type_masks) + \
+                    FEATURE_PENALTY * len(role.predicate.features)
+                total += min([Resolver._penalty(role.predicate, ctx.senses[c][chosen[c]])
+                              for c in children if ctx.senses[c]], default=unfilled)
+        penalties.append(total)
+    return sorted(penalties)
+
+
+@pytest.fixture(scope='module')
+def resolver(adapter):
+    return Resolver(ontology=adapter)
+
+
+def test_lowest_penalties_match_brute_force(resolver):
+    ctx = make_context(resolver, ['put', 'box', 'table', 'take', 'red'], 2)
+    expected = brute_force_penalties(ctx)
+
+    found = resolver._fuzzy_interpretations(ctx, 50)
+    assert [i.penalty for i in found] == expected[:50]
+    assert len({tuple(sorted(i.senses.items())) for i in found}) == len(found)
+
+
+def test_all_interpretations_of_a_sentence(resolver, put_xml):
+    ctx = ResolutionContext()
+    resolver._get_relations_and_senses(ctx, LogicalForm(put_xml))
+    expected = brute_force_penalties(ctx)
+
+    found = resolver._fuzzy_interpretations(ctx, len(expected) + 10)
+    assert [i.penalty for i in found] == expected
+
+
+def test_best_interpretation_does_not_enumerate(resolver, monkeypatch):
+    ctx = make_context(resolver, ['put', 'box', 'table', 'take', 'red', 'move', 'on', 'go'], 3)
+    assert functools.reduce(operator.mul, (len(s) for s in ctx.senses), 1) > 1000000
+
+    pushes = []
+    push = heapq.heappush
+
+    def counting_push(queue, item):
+        pushes.append(item)
+        push(queue, item)
+
+    monkeypatch.setattr(resolver_module.heapq, 'heappush', counting_push)
+    found = resolver._fuzzy_interpretations(ctx, 1)
+
+    assert len(found) == 1
+    # Equal bounds are broken towards deeper assignments, so the search follows one path down instead of expanding
+    # every prefix with the same bound.
+    assert len(pushes) <= 2 * sum(len(s) for s in ctx.senses)
+
+
+def test_resolve_returns_count_interpretations(resolver, put_xml):
+    ctx = resolver.resolve_lf(LogicalForm(put_xml), ResolveType.FUZZY, 3)
+    assert len(ctx.interpretations) == 3
+    assert ctx.interpretations == sorted(ctx.interpretations, key=lambda i: i.penalty)
+    assert ctx.unsatisfied == {(b, role) for b, role, _ in ctx.interpretations[0].violations}
@@ -0,0 +1,85 @@
+"""
+Instrumentation: sinks, the timed decorator, and the counters the resolver reports in both modes.
+"""
+
+import pytest
+
+from instrumentation import INSTRUMENTS, Instrumentation, Sink, HistogramSink, PrometheusFileSink
+from logical_form import LogicalForm
+from resolver import Resolver, ResolveType, _print_pipeline_stats
+
+
+@pytest.fixture
+def stats():
+    sink = INSTRUMENTS.add_sink(HistogramSink())
+    yield sink
+    INSTRUMENTS.remove_sink(sink)
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        Sink()
+
+    class TimingOnly(Sink):
+        def timing(self, name, seconds):
+            pass
+
+    with pytest.raises(TypeError):
+        TimingOnly()
+
+
+def test_timed_records_calls_that_raise():
+    instruments = Instrumentation()
+
+    @instruments.timed('stage')
+    def fail():
+        raise KeyError
+
+    with pytest.raises(KeyError):
+        fail()  # Disabled: nothing to record into
+
+    sink = instruments.add_sink(HistogramSink())
+    with pytest.raises(KeyError):
+        fail()
+    assert sink.timers()['stage'].count == 1
+
+    instruments.remove_sink(sink)
+    assert not instruments.enabled
+
+
+def test_prometheus_format(tmp_path):
+    sink = PrometheusFileSink(str(tmp_path / 'resolver.prom'), buckets=(0.1, 1.0))
+    sink.timing('parse', 0.5)
+    sink.timing('parse', 2.0)
+    sink.count('bindings', 3)
+    sink.flush()
+
+    assert (tmp_path / 'resolver.prom').read_text() == (
+        '# TYPE resolver_parse_seconds histogram\n'
+        'resolver_parse_seconds_bucket{le="0.1"} 0\n'
+        'resolver_parse_seconds_bucket{le="1.0"} 1\n'
+        'resolver_parse_seconds_bucket{le="+Inf"} 2\n'
+        'resolver_parse_seconds_sum 2.5\n'
+        'resolver_parse_seconds_count 2\n'
+        '# TYPE resolver_bindings_total counter\n'
+        'resolver_bindings_total 3\n'
+    )
+    assert [p.name for p in tmp_path.iterdir()] == ['resolver.prom']
+
+
+@pytest.mark.parametrize('mode', list(ResolveType))
+def test_restriction_checks_are_counted(adapter, put_xml, stats, mode):
+    Resolver(ontology=adapter).resolve_lf(LogicalForm(put_xml), mode, 3)
+    counters = stats.counters()
+    assert counters['restriction_checks'] > 0
+    assert counters['candidates'] > 0
+
+
+def test_pipeline_stats(adapter, put_xml, stats, capsys):
+    resolver = Resolver(ontology=adapter)
+    ctx = resolver.resolve_lf(LogicalForm(put_xml), ResolveType.STRICT)
+    _print_pipeline_stats(resolver, ctx, stats)
+
+    out = capsys.readouterr().out
+    assert 'Restriction checks: ' in out
+    assert 'Candidate cross product: ' in out
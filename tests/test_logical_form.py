@@ -0,0 +1,163 @@
+"""
+LogicalForm: XML backends, template matching, its memo and the cached subtree properties.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import read_data, SENTENCES
+from logical_form import LogicalForm, XmlBackend
+
+PUT_TEMPLATE = read_data('put_template.xml')
+
+
+def describe(comp: LogicalForm.Component, seen=None):
+    """
+    Everything a Component holds, following references once.
+    """
+    seen = set() if seen is None else seen
+    if comp.comp_id in seen:
+        return 'REF', comp.comp_id
+    seen.add(comp.comp_id)
+    roles = [{name: [describe(c, seen) if isinstance(c, LogicalForm.Component) else c for c in comps]
+              for name, comps in rg.items()} for rg in comp.roles]
+    return comp.comp_id, comp.indicator, comp.comp_type, comp.word, roles
+
+
+def cyclic_template() -> LogicalForm:
+    """
+    A request to PUT whose RESULT is the PUT itself.
+    """
+    template = LogicalForm(template='<component indicator="SPEECHACT"><role name="CONTENT">'
+                                    '<component type="ONT::PUT" map_param="action"/></role></component>')
+    inner = template.get_tree().roles[0]['CONTENT'][0]
+    inner.roles = ({'RESULT': (inner,)},)
+    return template
+
+
+def test_cyclic_shapes_are_deterministic(put_xml):
+    first, second = cyclic_template(), cyclic_template()
+    assert first.get_tree().shape == second.get_tree().shape
+    assert first.get_tree().shape != LogicalForm(template=PUT_TEMPLATE).get_tree().shape
+
+    lf = LogicalForm(put_xml)
+    expected = lf.match_template(first)
+    known = len(LogicalForm.Component._shapes)
+    for _ in range(20):
+        LogicalForm.Component._invalidate()
+        assert lf.match_template(first) == expected
+        assert lf.match_template(second) == expected
+    assert len(LogicalForm.Component._shapes) == known
+
+
+@pytest.mark.parametrize('xml_name', sorted(SENTENCES.values()))
+def test_backends_build_identical_trees(xml_name):
+    pytest.importorskip('lxml')
+    xml_str = read_data(xml_name)
+    # Comments, processing instructions and multi-word entries must not set the backends apart.
+    variant = xml_str.replace('<LF:word>PUT</LF:word>',
+                              '<!-- a comment --><LF:word>PUT</LF:word><?pi data?><LF:word>DOWN</LF:word>')
+
+    for text in [xml_str, variant]:
+        soup, streamed = LogicalForm(text), LogicalForm(text, backend=XmlBackend.LXML)
+        assert describe(streamed.get_tree()) == describe(soup.get_tree())
+        assert streamed.pretty_format() == soup.pretty_format()
+
+
+def test_backends_reject_empty_replies():
+    pytest.importorskip('lxml')
+    empty = '<?xml version="1.0"?><trips-parser-output><utt></utt></trips-parser-output>'
+    for backend in XmlBackend:
+        with pytest.raises(IndexError):
+            LogicalForm(empty, backend=backend)
+
+
+def uncached(comp: LogicalForm.Component, seen=None):
+    """
+    Recompute resolved and bound_params of a subtree without the per-node caches.
+    """
+    seen = set() if seen is None else seen
+    if id(comp) in seen:
+        return True, set()
+    seen.add(id(comp))
+    resolved, params = comp._resolved, set(comp.param_mapping)
+    for rg in comp.roles:
+        for comps in rg.values():
+            for c in comps:
+                if isinstance(c, LogicalForm.Component):
+                    c_resolved, c_params = uncached(c, seen)
+                    resolved, params = resolved and c_resolved, params | c_params
+    return resolved, params
+
+
+def test_cached_properties_follow_resolution():
+    def template(text):
+        return LogicalForm(template=text)
+
+    library = {
+        'act': template('<component id="act" type="ONT::PUT" map_param="action">'
+                        '<role name="AFFECTED"><component from_id="obj"/></role></component>'),
+        'obj': template('<component id="obj" map_param="object"/>')
+    }
+    first = template('<component indicator="SPEECHACT"><role name="CONTENT"><component from_id="act"/></role>'
+                     '</component>')
+    second = template('<component indicator="SPEECHACT" map_param="request"><role name="CONTENT">'
+                      '<component from_id="act"/></role></component>')
+
+    def check(lf, resolved, params):
+        # Read twice: once to fill the caches, once from them.
+        for _ in range(2):
+            assert (lf.get_tree().resolved, lf.bindings) == (resolved, params) == uncached(lf.get_tree())
+
+    check(first, False, set())
+    check(second, False, {'request'})
+
+    first.resolve(library)
+    second.resolve(library)
+    check(first, False, {'action'})
+    check(second, False, {'request', 'action'})
+
+    # Both now share the role lists of 'act', so resolving 'act' must show in them too.
+    library['act'].resolve(library)
+    check(library['act'], True, {'action', 'object'})
+    check(first, True, {'action', 'object'})
+    check(second, True, {'request', 'action', 'object'})
+
+    copy = first.bindings
+    copy.add('changed')
+    assert first.bindings == {'action', 'object'}
+
+
+class _YieldingDict(dict):
+    """
+    A dict that lets other threads run whenever its size is taken, to widen any race on numbering by size.
+    """
+
+    def __len__(self):
+        size = super().__len__()
+        time.sleep(0)
+        return size
+
+
+def test_threads_number_shapes_uniquely():
+    LogicalForm.Component._shapes = _YieldingDict(LogicalForm.Component._shapes)
+    try:
+        templates = [LogicalForm(template=f'<component word="SHAPE{i}"><role name="CONTENT">'
+                                          f'<component word="INNER{i}"/></role></component>') for i in range(200)]
+        start = threading.Barrier(8)
+
+        def shapes(offset):
+            start.wait()
+            return [t.get_tree().shape for t in templates[offset:] + templates[:offset]]
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(shapes, range(0, 200, 25)))
+    finally:
+        LogicalForm.Component._shapes = dict(LogicalForm.Component._shapes)
+
+    numbers = list(LogicalForm.Component._shapes.values())
+    assert len(set(numbers)) == len(numbers)
+    assert len({t.get_tree().shape for t in templates}) == len(templates)
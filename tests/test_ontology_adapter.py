@@ -0,0 +1,110 @@
+"""
+The ontology adapter: compiled restriction predicates and the match memo must agree with the raw restrictions, and the
+frozen view with the adapter.
+"""
+
+import dataclasses
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from logical_form import LogicalForm
+from ontology_adapter import MatchMemo, PREDICATES, RestrictionType
+from resolver import Resolver, ResolveType
+
+WORDS = ['put', 'take', 'move', 'give', 'on', 'red', 'box', 'table', 'person', 'water', 'idea']
+
+
+def raw_matches(s, restrictions) -> bool:
+    """
+    Test a sense against raw restrictions by type name, without masks or predicates.
+    """
+    types = {s.name[len('ont::'):]} | set(s.ancestry)
+    for r in restrictions:
+        if r.type in [RestrictionType.TYPE, RestrictionType.TYPEQ]:
+            values = [r.values] if isinstance(r.values, str) else r.values
+            if not r.wildcard and not types.intersection(v.lower() for v in values):
+                return False
+        elif r.type is RestrictionType.FEATURES:
+            for f_name, f_val in r.values:
+                if isinstance(f_val, str) and s.features.get(f_name, '').lower() != f_val.lower():
+                    return False
+    return True
+
+
+@pytest.fixture(scope='module')
+def senses(adapter):
+    return [s for word in WORDS for s in adapter.get_senses(word)]
+
+
+@pytest.fixture(scope='module')
+def roles(senses):
+    return [r for s in senses for r in s.roles.values()]
+
+
+def test_predicates_match_raw_restrictions(senses, roles):
+    memo = MatchMemo()
+    for role in roles:
+        for s in senses:
+            expected = raw_matches(s, role.restrictions)
+            assert role.predicate.evaluate(s) == expected, (s, role)
+            assert memo.matches(s, role.predicate) == expected
+            assert memo.matches(s, role.predicate) == expected  # Now from the memo
+            assert Resolver.matches_restrictions(s, role.restrictions) == expected
+    assert memo.hits >= memo.misses
+
+
+def test_equal_restrictions_share_a_predicate(roles):
+    for role in roles:
+        assert PREDICATES.compile(role.restrictions) is role.predicate
+    assert len({r.predicate.pid for r in roles}) == len({r.predicate for r in roles})
+
+
+def test_memo_is_bounded(senses, roles):
+    memo = MatchMemo(maxsize=8)
+    for role in roles[:20]:
+        for s in senses:
+            assert memo.matches(s, role.predicate) == role.predicate.evaluate(s)
+    assert len(memo) == 8
+    assert memo.evictions == memo.misses - 8
+
+
+@pytest.fixture(scope='module')
+def view(adapter):
+    return adapter.freeze()
+
+
+def test_view_matches_adapter(adapter, view):
+    words = list(view)[::50] + WORDS
+    for word in words:
+        assert view.get_senses(word) == adapter.get_senses(word), word
+    assert view.get_senses('no such word') == adapter.get_senses('no such word') == ()
+
+
+def test_view_senses_are_read_only(view):
+    s = view.get_senses('put')[0]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        s.name = 'ont::changed'
+    with pytest.raises(TypeError):
+        s.roles['agent'] = None
+    with pytest.raises(TypeError):
+        s.features['type'] = None
+    assert {s: True}[view.get_senses('put')[0]]
+
+
+def test_threads_share_a_view(view, put_xml, red_box_xml):
+    resolver = Resolver(ontology=view)
+
+    def resolve(job):
+        xml_str, mode = job
+        ctx = resolver.resolve_lf(LogicalForm(xml_str), mode, 3)
+        interpretations = ctx.interpretations
+        if mode is ResolveType.STRICT:
+            interpretations = list(resolver.iter_interpretations(ctx, 3))
+        return ctx.bindings, ctx.unsatisfied, interpretations
+
+    jobs = list(itertools.product([put_xml, red_box_xml], ResolveType)) * 10
+    expected = [resolve(job) for job in jobs]
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(resolve, jobs)) == expected
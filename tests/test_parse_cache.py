@@ -0,0 +1,38 @@
+"""
+ParseCache: hits, misses and tolerance of caches the process cannot write to.
+"""
+
+import os
+
+from parse_cache import ParseCache
+
+URL = 'http://localhost/parser/cgi/parse'
+
+
+def test_round_trip(tmp_path, put_xml):
+    cache = ParseCache(str(tmp_path))
+    assert cache.get('put the box on the table', URL) is None
+    cache.put('put the box on the table', URL, put_xml)
+    assert cache.get('  put the   box on the table ', URL) == put_xml
+    assert cache.get('put the box on the table', 'http://elsewhere') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_damaged_entry_is_a_miss(tmp_path, put_xml):
+    cache = ParseCache(str(tmp_path))
+    cache.put('put the box on the table', URL, put_xml)
+    with open(cache._path(cache.key('put the box on the table', URL)), 'wb') as f:
+        f.write(b'not compressed')
+    assert cache.get('put the box on the table', URL) is None
+
+
+def test_hit_on_read_only_cache(tmp_path, put_xml, monkeypatch):
+    cache = ParseCache(str(tmp_path))
+    cache.put('put the box on the table', URL, put_xml)
+
+    def refuse(path, *args, **kwargs):
+        raise PermissionError(1, 'Operation not permitted', path)
+
+    monkeypatch.setattr(os, 'utime', refuse)
+    assert cache.get('put the box on the table', URL) == put_xml
+    assert cache.hits == 1
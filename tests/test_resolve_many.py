@@ -0,0 +1,78 @@
+"""
+Batch resolution on worker processes must give the same results as resolving in this process.
+"""
+
+import multiprocessing
+import pickle
+
+import pytest
+
+from conftest import SENTENCES
+from resolver import Resolver, ResolveType, MatchEngine, _init_worker
+from trips_parser import TripsAPI
+
+BATCH = list(SENTENCES) * 2 + ['a sentence that was never recorded']
+
+
+@pytest.fixture(scope='module')
+def resolver(adapter, trips_url):
+    return Resolver(api=TripsAPI(trips_url), ontology=adapter)
+
+
+def summary(result):
+    interpretations = [(i.penalty, sorted(i.senses.items()), i.violations) for i in result.interpretations or []]
+    return result.index, result.sentence, result.bindings, result.unsatisfied, interpretations, result.ok
+
+
+@pytest.mark.parametrize('mode, count', [(ResolveType.FUZZY, 3), (ResolveType.STRICT, None), (ResolveType.STRICT, 3)])
+def test_workers_match_in_process(resolver, mode, count):
+    local = [summary(r) for r in resolver.resolve_many(BATCH, mode, count, workers=1)]
+    pooled = [summary(r) for r in resolver.resolve_many(BATCH, mode, count, workers=2)]
+    assert pooled == local
+
+
+def test_failures_stay_on_their_result(resolver):
+    results = list(resolver.resolve_many(BATCH, ResolveType.FUZZY, 2, workers=2))
+    assert [r.ok for r in results] == [True] * (len(BATCH) - 1) + [False]
+    assert all(r.interpretations for r in results[:-1])
+
+
+def test_in_process_batches_interleave(resolver):
+    expected = [summary(r) for r in resolver.resolve_many(BATCH, ResolveType.FUZZY, 2, workers=1)]
+
+    first = resolver.resolve_many(BATCH, ResolveType.FUZZY, 2, workers=1)
+    second = resolver.resolve_many(BATCH, ResolveType.FUZZY, 2, workers=1)
+    results = [next(first)]
+    assert summary(next(second)) == expected[0]
+    second.close()
+    results += list(first)
+
+    assert [summary(r) for r in results] == expected
+    assert [r.ok for r in results] == [True] * (len(BATCH) - 1) + [False]
+
+
+def test_interpretations_pickle(resolver):
+    ctx = resolver.resolve_context('put the box on the table', ResolveType.FUZZY, 2)
+    assert pickle.loads(pickle.dumps(ctx.interpretations)) == ctx.interpretations
+    strict = resolver.resolve_context('put the box on the table', ResolveType.STRICT)
+    found = list(resolver.iter_interpretations(strict, 2))
+    assert pickle.loads(pickle.dumps(found)) == found
+
+
+def _worker_ontology():
+    import resolver
+    adapter = resolver._worker_resolver._adapter
+    return type(adapter).__name__, [s.name for s in adapter.get_senses('box')]
+
+
+def test_spawned_workers_keep_the_ontology(adapter, trips_url):
+    view = adapter.freeze()
+    copy = pickle.loads(pickle.dumps(view))
+    assert type(copy) is type(view) and len(copy) == len(view)
+    assert copy.get_senses('box') == view.get_senses('box')
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, initializer=_init_worker, initargs=(MatchEngine.SCALAR, TripsAPI(trips_url), view)) as pool:
+        name, senses = pool.apply(_worker_ontology)
+    assert name == 'OntologyView'
+    assert senses == [s.name for s in view.get_senses('box')]
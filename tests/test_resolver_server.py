@@ -0,0 +1,73 @@
+"""
+The resolver server: replies decoded by a client must match resolving in this process, over TCP and Unix sockets.
+"""
+
+import sys
+
+import pytest
+
+import resolver as resolver_module
+from logical_form import LogicalForm
+from resolver import Resolver, ResolveType
+from resolver_server import ResolverServer, UnixResolverServer, ResolverClient, decode_result
+from trips_parser import TripsAPI
+
+
+@pytest.fixture(scope='module')
+def resolver(adapter, trips_url):
+    return Resolver(api=TripsAPI(trips_url), ontology=adapter)
+
+
+@pytest.fixture(scope='module', params=['tcp', 'unix'])
+def client(request, resolver, tmp_path_factory):
+    if request.param == 'tcp':
+        server = ResolverServer(resolver)
+    else:
+        server = UnixResolverServer(resolver, str(tmp_path_factory.mktemp('socket') / 'resolver.sock'))
+    server.start()
+    yield ResolverClient(server.address, timeout=10)
+    server.shutdown()
+    server.server_close()
+
+
+def local_result(resolver, ctx, mode, count):
+    interpretations = ctx.interpretations
+    if mode is ResolveType.STRICT:
+        interpretations = list(resolver.iter_interpretations(ctx, count)) if count else None
+    return ctx.bindings, ctx.unsatisfied, interpretations
+
+
+@pytest.mark.parametrize('mode, count', [(ResolveType.STRICT, None), (ResolveType.STRICT, 3), (ResolveType.FUZZY, 3)])
+def test_round_trip(resolver, client, put_xml, red_box_xml, mode, count):
+    assert client.health()
+    ctx = resolver.resolve_context('put the red box on the table', mode, count)
+    assert decode_result(client.resolve('put the red box on the table', mode, count)) == \
+        local_result(resolver, ctx, mode, count)
+
+    ctx = resolver.resolve_lf(LogicalForm(put_xml), mode, count)
+    assert decode_result(client.resolve(mode=mode, count=count, xml=put_xml)) == \
+        local_result(resolver, ctx, mode, count)
+
+
+@pytest.mark.parametrize('count', [True, 0, -1, 2.5, '3'])
+def test_bad_counts_are_rejected(client, count):
+    with pytest.raises(RuntimeError, match='replied 400'):
+        client.resolve('put the box on the table', ResolveType.FUZZY, count)
+
+
+def test_errors_are_reported(client):
+    with pytest.raises(RuntimeError, match='replied 500'):
+        client.resolve('a sentence that was never recorded')
+    with pytest.raises(RuntimeError, match='replied 400'):
+        client._request('POST', '/resolve', {'sentence': 'put the box on the table', 'xml': '<x/>'})
+
+
+@pytest.mark.parametrize('option', [['-e', 'bitset'], ['-c', 'cache'], ['--profile', 'out.txt'],
+                                    ['--metrics', 'out.prom']])
+def test_local_options_are_refused_with_server(monkeypatch, capsys, option):
+    monkeypatch.setattr(sys, 'argv', ['resolver.py', 'a sentence', '-m', 'strict', '-s', 'http://localhost:1'] +
+                        option)
+    with pytest.raises(SystemExit) as exit_info:
+        resolver_module.main()
+    assert exit_info.value.code == 2
+    assert 'cannot be combined with --server' in capsys.readouterr().err
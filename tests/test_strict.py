@@ -0,0 +1,82 @@
+"""
+STRICT resolution: complete interpretations must agree with the bindings and unsatisfied roles of the same context.
+"""
+
+import itertools
+
+import pytest
+
+from logical_form import LogicalForm
+from resolver import Resolver, ResolveType
+
+
+@pytest.fixture(scope='module')
+def resolver(adapter):
+    return Resolver(ontology=adapter)
+
+
+def brute_force(ctx):
+    """
+    Every assignment of the remaining senses in which each required specific role is filled by a chosen child.
+    """
+    variables = [v for v, senses in enumerate(ctx.senses) if senses]
+    found = []
+    for combo in itertools.product(*[ctx.senses[v] for v in variables]):
+        chosen = dict(zip(variables, combo))
+        if all(any(Resolver.matches_predicate(chosen[c], role.predicate) for c in children if c in chosen)
+               for parent, children in ctx.groups() if parent in chosen
+               for role in chosen[parent].roles.values() if role.is_specific() and not role.optional):
+            found.append(sorted((ctx.labels[v], s.name) for v, s in chosen.items()))
+    return sorted(found)
+
+
+@pytest.mark.parametrize('name', ['put_xml', 'red_box_xml'])
+def test_interpretations_match_brute_force(resolver, request, name):
+    ctx = resolver.resolve_lf(LogicalForm(request.getfixturevalue(name)), ResolveType.STRICT)
+    found = sorted(sorted(i.senses.items()) for i in resolver.iter_interpretations(ctx))
+    assert found == brute_force(ctx)
+    assert found
+    assert len(list(resolver.iter_interpretations(ctx, 3))) == 3
+
+
+@pytest.mark.parametrize('name', ['put_xml', 'red_box_xml'])
+def test_interpretations_agree_with_unsatisfied(resolver, request, name):
+    ctx = resolver.resolve_lf(LogicalForm(request.getfixturevalue(name)), ResolveType.STRICT)
+    failed = {binding for binding, _ in ctx.unsatisfied}
+    for interpretation in resolver.iter_interpretations(ctx):
+        assert not failed & set(interpretation.senses.items())
+    assert not failed & set(ctx.bindings)
+
+
+def test_senses_without_fitting_roles_are_unsatisfied(resolver, red_box_xml):
+    ctx = resolver.resolve_lf(LogicalForm(red_box_xml), ResolveType.STRICT)
+    assert (('RED_2', 'ont::internal-body-part'), 'ALL') in ctx.unsatisfied
+    assert all(s.name != 'ont::internal-body-part' for s in ctx.senses[2])
+
+
+class WithoutWord:
+    """
+    An ontology that does not know one word.
+    """
+
+    def __init__(self, adapter, word):
+        self._adapter = adapter
+        self._word = word
+
+    def get_senses(self, word):
+        return () if word.lower() == self._word else self._adapter.get_senses(word)
+
+    def __getattr__(self, name):
+        return getattr(self._adapter, name)
+
+
+def test_unknown_words_do_not_prune_their_children(adapter, red_box_xml):
+    resolver = Resolver(ontology=WithoutWord(adapter, 'put'))
+    ctx = resolver.resolve_lf(LogicalForm(red_box_xml), ResolveType.STRICT)
+
+    assert not ctx.senses[ctx.labels.index('PUT_0')]
+    assert all(ctx.senses[v] for v, label in enumerate(ctx.labels) if label != 'PUT_0')
+    bound = {(t_var, fit[0]) for (t_var, _), roles in ctx.bindings.items() for fits in roles.values() for fit in fits}
+    assert {('RED_2', 'BOX_1'), ('ON_3', 'TABLE_4')} <= bound
+    found = sorted(sorted(i.senses.items()) for i in resolver.iter_interpretations(ctx))
+    assert found and found == brute_force(ctx)
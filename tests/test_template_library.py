@@ -0,0 +1,75 @@
+"""
+TemplateLibrary: the index must find exactly the templates a linear scan with match_template finds, in order.
+"""
+
+import itertools
+
+import pytest
+
+from conftest import SENTENCES, read_data
+from logical_form import LogicalForm
+from template_library import TemplateLibrary
+
+
+def attrs(**values) -> str:
+    return ''.join(f' {name}="{value}"' for name, value in values.items() if value)
+
+
+def generate_templates():
+    """
+    Templates varying every attribute the index files them under, and the role names of their rolegroups.
+    """
+    contents = [
+        '',
+        '<role name="AFFECTED"><component map_param="object"/></role>',
+        '<role name="AFFECTED"><component map_param="object"/></role>'
+        '<role name="RESULT"><component word="ON,IN"><role name="GROUND"><component map_param="location"/></role>'
+        '</component></role>',
+        '<rolegroup><role name="INSTRUMENT"><component/></role></rolegroup>'
+        '<rolegroup><role name="AFFECTED"><component type="ONT::CONTAINER" map_param="object"/></role></rolegroup>',
+    ]
+    roots = [
+        '<role name="CONTENT">{}</role>',
+        '<rolegroup><role name="NOPE"><component/></role></rolegroup><rolegroup><role name="CONTENT">{}</role>'
+        '</rolegroup>',
+        '<role name="CONTENT">{}</role><role name="NOPE"><component/></role>',
+    ]
+    for indicator, sa_type, root, c_type, word, content in itertools.product(
+            [None, 'SPEECHACT', 'F'], [None, 'SA_REQUEST', 'SA_TELL'], roots, [None, 'ONT::PUT', 'ONT::TAKE'],
+            [None, 'PUT'], contents):
+        inner = f'<component{attrs(type=c_type, word=word)} map_param="action">{content}</component>'
+        yield LogicalForm(template=f'<component{attrs(indicator=indicator, type=sa_type)}>{root.format(inner)}'
+                                   f'</component>')
+
+
+def replies():
+    """
+    The recorded replies, and variants that fewer templates match.
+    """
+    for name in sorted(SENTENCES.values()):
+        xml_str, stem = read_data(name), name[:-len('.xml')]
+        yield pytest.param(xml_str, id=stem)
+        yield pytest.param(xml_str.replace('ONT::PUT', 'ONT::MOVE').replace('<LF:word>PUT', '<LF:word>MOVE'),
+                           id=f'{stem}-move')
+        yield pytest.param(xml_str.replace('SA_REQUEST', 'SA_TELL').replace('role:AFFECTED', 'role:INSTRUMENT'),
+                           id=f'{stem}-tell')
+
+
+@pytest.fixture(scope='module')
+def library():
+    return TemplateLibrary(generate_templates())
+
+
+@pytest.mark.parametrize('xml_str', list(replies()))
+def test_index_matches_linear_scan(library, xml_str):
+    lf = LogicalForm(xml_str)
+
+    expected = []
+    for template in library:
+        matched, params = lf.match_template(template)
+        if matched:
+            expected.append((template, params))
+
+    assert len(library.candidates(lf)) < len(library)
+    assert library.match(lf) == expected
+    assert library.match_first(lf) == (expected[0] if expected else None)
@@ -0,0 +1,93 @@
+"""
+A directory of recorded TRIPS parser replies, used to replay the parser offline.
+
+Each fixture is a pair of files named by a hash of the normalized sentence: <key>.xml holds the reply and <key>.txt
+holds the sentence itself, so a fixture directory can be inspected and edited by hand.
+
+:author: Sergey Goldobin
+:date: 08/05/2020
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import *
+
+from parse_cache import normalize_sentence
+
+
+class FixtureStore:
+    """
+    A persistent map of sentence -> recorded parser reply.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Open (or create) a fixture directory.
+        :param directory:
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.xml'))
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """
+        Iterate over all fixtures in a stable order.
+        :return: A generator of (sentence, reply XML). The sentence is empty if it was not recorded.
+        """
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.xml'):
+                continue
+            key = name[:-len('.xml')]
+            sentence = self._read(key + '.txt') or ''
+            xml_str = self._read(name)
+            if xml_str is not None:
+                yield sentence, xml_str
+
+    @staticmethod
+    def key(sentence: str) -> str:
+        """
+        Get the file name stem of a sentence's fixture.
+        :param sentence:
+        :return:
+        """
+        return hashlib.sha1(normalize_sentence(sentence).encode()).hexdigest()
+
+    def _read(self, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name: str, text: str) -> NoReturn:
+        # Write atomically, so a replaying server never serves half a fixture.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, sentence: str) -> Optional[str]:
+        """
+        Look up the recorded reply for a sentence.
+        :param sentence:
+        :return: The reply XML, or None if the sentence was never recorded.
+        """
+        return self._read(FixtureStore.key(sentence) + '.xml')
+
+    def put(self, sentence: str, xml_str: str) -> NoReturn:
+        """
+        Record the reply for a sentence, replacing any previous recording.
+        :param sentence:
+        :param xml_str: The parser's reply.
+        :return:
+        """
+        key = FixtureStore.key(sentence)
+        self._write(key + '.txt', normalize_sentence(sentence))
+        self._write(key + '.xml', xml_str)
@@ -7,8 +7,12 @@ An interface for TRIPS Web API.
 
 import requests
 import argparse
+from typing import *
 
-from logical_form import LogicalForm
+from instrumentation import INSTRUMENTS
+from logical_form import LogicalForm, XmlBackend
+from parse_cache import ParseCache
+from trips_fixtures import FixtureStore
 
 
 class TripsAPI:
@@ -18,35 +22,70 @@ class TripsAPI:
 
     _URL = "http://trips.ihmc.us/parser/cgi/parse"
 
-    @staticmethod
-    def parse(sentence: str) -> LogicalForm:
+    def __init__(self, url: str = None, cache: ParseCache = None, record: FixtureStore = None,
+                 backend: XmlBackend = XmlBackend.BS4):
         """
-        Convert a sentence to Logical Form.
+        Create an API wrapper.
+        :param url: The parser endpoint. Defaults to the public IHMC parser.
+        :param cache: An optional persistent cache of parser replies, consulted before every request.
+        :param record: An optional fixture store. Every reply obtained from the parser is recorded into it.
+        :param backend: The XML parser used to build LogicalForms from replies.
+        """
+        self.url = url or TripsAPI._URL
+        self.cache = cache
+        self.record = record
+        self.backend = backend
+
+    def fetch(self, sentence: str) -> Optional[str]:
+        """
+        Obtain the raw XML parse of a sentence, from the cache if possible.
         :param sentence: A recognized sentence string.
-        :return: A LogicalForm instance.
+        :return: The parser's reply, or None if the request failed.
         """
+        if self.cache is not None:
+            xml_str = self.cache.get(sentence, self.url)
+            if xml_str is not None:
+                return xml_str
+
         # TODO: This is a decision point. Sometime later I need to determine if I'll be doing any cleaning to the
         # sentence (which just came out of Google Speech), or if I'm using it "as is".
         post_data = {"input": sentence}
         reply = None
 
         try:
-            reply = requests.post(TripsAPI._URL, post_data)
+            reply = requests.post(self.url, post_data)
         except Exception as e:
             print(f'There was an error processing a web request: {e}')
-            return LogicalForm(None)
+            return None
 
         xml_str = reply.text
-        return LogicalForm(xml_str)
+        if reply.ok:
+            if self.cache is not None:
+                self.cache.put(sentence, self.url, xml_str)
+            if self.record is not None:
+                self.record.put(sentence, xml_str)
+        return xml_str
+
+    @INSTRUMENTS.timed('parse')
+    def parse(self, sentence: str) -> LogicalForm:
+        """
+        Convert a sentence to Logical Form.
+        :param sentence: A recognized sentence string.
+        :return: A LogicalForm instance.
+        """
+        return LogicalForm(self.fetch(sentence), backend=self.backend)
 
 
 if __name__ == '__main__':
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("text", help="Text to be semantically parsed.")
+    arg_parser.add_argument("-u", "--url", default=None, help="TRIPS parser endpoint.")
+    arg_parser.add_argument("-r", "--record", metavar="DIR", default=None, help="Record the reply into this fixture "
+                                                                                "directory.")
     args = arg_parser.parse_args()
 
     print(f'Parsing into AMR:\t{args.text}')
-    api = TripsAPI()
+    api = TripsAPI(args.url, record=FixtureStore(args.record) if args.record else None)
     lf = api.parse(args.text)
 
     print(lf.pretty_format())
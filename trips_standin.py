@@ -0,0 +1,114 @@
+"""
+A local stand-in for the TRIPS web parser that replays recorded replies from a FixtureStore.
+Point TripsAPI (or AsyncTripsAPI) at it to run the pipeline reproducibly and without network noise.
+
+:author: Sergey Goldobin
+:date: 08/05/2020
+"""
+
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import *
+from urllib.parse import parse_qs, urlparse
+
+from trips_fixtures import FixtureStore
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Answers parse requests the way the TRIPS CGI endpoint does: the sentence arrives in an 'input' form field.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        self._reply(parse_qs(body).get('input', [None])[0])
+
+    def do_GET(self):
+        self._reply(parse_qs(urlparse(self.path).query).get('input', [None])[0])
+
+    def _reply(self, sentence: Optional[str]):
+        if sentence is None:
+            self.send_error(400, 'Missing "input" parameter')
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        xml_str = self.server.store.get(sentence)
+        if xml_str is None:
+            self.send_error(404, f'No recorded parse for "{sentence}"')
+            return
+
+        data = xml_str.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    A multi-threaded HTTP server replaying recorded TRIPS replies with an optional injected latency.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store: FixtureStore, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 verbose: bool = False):
+        """
+        Bind the server. Call serve_forever() or start() to begin answering requests.
+        :param store: The recorded replies to serve.
+        :param host: Interface to bind.
+        :param port: Port to bind. 0 picks a free one; see url.
+        :param latency: Seconds to wait before answering each request, to imitate the real parser.
+        :param verbose: Log every request to stderr.
+        """
+        super().__init__((host, port), _ReplayHandler)
+        self.store = store
+        self.latency = latency
+        self.verbose = verbose
+
+    @property
+    def url(self) -> str:
+        """
+        The endpoint to hand to TripsAPI.
+        :return:
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/parser/cgi/parse'
+
+    def start(self) -> threading.Thread:
+        """
+        Serve requests on a background thread. Stop with shutdown().
+        :return: The serving thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Replay recorded TRIPS parser replies over HTTP.')
+    arg_parser.add_argument("fixtures", help="Fixture directory, as written by TripsAPI in record mode.")
+    arg_parser.add_argument("-p", "--port", type=int, default=8042, help="Port to listen on.")
+    arg_parser.add_argument("--host", default='127.0.0.1', help="Interface to listen on.")
+    arg_parser.add_argument("-l", "--latency", type=float, default=0.0, help="Injected latency per request, seconds.")
+    arg_parser.add_argument("-v", "--verbose", action='store_true', help="Log every request.")
+    args = arg_parser.parse_args()
+
+    server = StandinServer(FixtureStore(args.fixtures), args.host, args.port, args.latency, args.verbose)
+    print(f'Serving {len(server.store)} recorded parses at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()